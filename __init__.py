@@ -6,12 +6,14 @@ __init__.py for ComfyUI-Blender-Bridge-node
 from .nodes.receiver import BlenderBridge_Receiver
 from .nodes.hub import BlenderBridge_DataHub
 from .nodes.sender import BlenderBridge_Sender
+from .nodes.cryptomatte import BlenderBridge_Cryptomatte
 
 # A dictionary that maps class names to class objects
 NODE_CLASS_MAPPINGS = {
     "BlenderBridge_Receiver": BlenderBridge_Receiver,
     "BlenderBridge_DataHub": BlenderBridge_DataHub,
     "BlenderBridge_Sender": BlenderBridge_Sender,
+    "BlenderBridge_Cryptomatte": BlenderBridge_Cryptomatte,
 }
 
 # A dictionary that contains the friendly name displayed on the front-end
@@ -19,6 +21,7 @@ NODE_DISPLAY_NAME_MAPPINGS = {
     "BlenderBridge_Receiver": "Blender Bridge Receiver",
     "BlenderBridge_DataHub": "Blender Bridge Data Hub",
     "BlenderBridge_Sender": "Blender Bridge Sender",
+    "BlenderBridge_Cryptomatte": "Blender Bridge Cryptomatte",
 }
 
 __all__ = ["NODE_CLASS_MAPPINGS", "NODE_DISPLAY_NAME_MAPPINGS"] 
\ No newline at end of file
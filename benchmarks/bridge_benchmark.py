@@ -0,0 +1,328 @@
+"""
+ComfyUI-Blender-Bridge 端到端基准测试。
+
+无需 ComfyUI 和 Blender 即可运行：
+  - 生成不同分辨率和通道数的合成多层 EXR（通道命名与 hub.COMPONENT_MAP 一致）
+  - 用一个模拟 Blender 的 ZMQ REQ 客户端驱动 zmq_server_worker
+  - 依次执行 Receiver -> DataHub -> Sender 节点（与 ComfyUI 执行队列相同，在主线程中串行）
+  - 用本地的 HTTP /update_image 服务器代替 Blender 接收 Sender 的结果
+
+输出每个配置的吞吐量、端到端延迟 (p50/p99)、各阶段延迟（来自 nodes/stats.py）以及各阶段运行期间的峰值 RSS
+（由后台线程在阶段运行时持续采样）。
+
+用法:
+    python benchmarks/bridge_benchmark.py
+    python benchmarks/bridge_benchmark.py --resolutions 1920x1080,3840x2160 --passes 4,15 --frames 20 --json result.json
+"""
+import argparse
+import contextlib
+import importlib.util
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+import types
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# DataHub 输出名称 -> Blender 的渲染通道名称
+BLENDER_PASS_NAMES = {
+    "image": "Combined", "depth": "Depth", "mist": "Mist", "normal": "Normal", "position": "Position",
+    "vector": "Vector", "diffuse_direct": "DiffDir", "diffuse_color": "DiffCol", "glossy_direct": "GlossDir",
+    "glossy_color": "GlossCol", "volume_direct": "VolumeDir", "emission": "Emit", "environment": "Env",
+    "shadow": "Shadow", "ambient_occlusion": "AO",
+}
+
+def install_folder_paths_stub(root):
+    """在导入节点之前注册一个最小的 folder_paths 模块（ComfyUI 之外不存在该模块）。"""
+    temp_dir = os.path.join(root, "temp")
+    output_dir = os.path.join(root, "output")
+    os.makedirs(temp_dir, exist_ok=True)
+    os.makedirs(output_dir, exist_ok=True)
+
+    stub = types.ModuleType("folder_paths")
+    stub.get_temp_directory = lambda: temp_dir
+    stub.get_output_directory = lambda: output_dir
+    sys.modules["folder_paths"] = stub
+
+def load_bridge_package():
+    """以包的形式导入仓库（节点模块使用相对导入）。"""
+    spec = importlib.util.spec_from_file_location(
+        "blender_bridge", os.path.join(REPO_ROOT, "__init__.py"), submodule_search_locations=[REPO_ROOT]
+    )
+    package = importlib.util.module_from_spec(spec)
+    sys.modules["blender_bridge"] = package
+    spec.loader.exec_module(package)
+    from blender_bridge.nodes import hub, receiver, sender, stats
+    return hub, receiver, sender, stats
+
+def frame_tag(index):
+    return f"frame-{index:010}".encode("ascii")
+
+def tag_payload(payload, index):
+    """
+    返回第 index 帧的载荷：复制预生成的 EXR 并改写头部的帧标记，长度不变，文件仍然有效。
+    每帧内容都不同，存储的去重和解码缓存不会让磁盘写入和解码被跳过。
+    """
+    tag = frame_tag(0)
+    offset = payload.find(tag)
+    data = bytearray(payload)
+    data[offset:offset + len(tag)] = frame_tag(index)
+    return data
+
+def write_synthetic_exr(path, width, height, pass_names, component_map, compression, seed):
+    """写入一个合成的多层 EXR，返回 Blender 会发送的 channel_map。"""
+    import Imath
+    import OpenEXR
+
+    rng = np.random.default_rng(seed)
+    header = OpenEXR.Header(width, height)
+    header["compression"] = Imath.Compression(getattr(Imath.Compression, compression))
+    pixels, channel_map = {}, {}
+    # 平滑的渐变加少量噪声，使压缩率接近真实渲染
+    gradient = np.linspace(0, 1, width, dtype=np.float32)[None, :] * np.linspace(0, 1, height, dtype=np.float32)[:, None]
+    for i, out_name in enumerate(pass_names):
+        base_name = f"ViewLayer.{BLENDER_PASS_NAMES[out_name]}"
+        channel_map["combined" if out_name == "image" else out_name] = base_name
+        for j, component in enumerate(component_map[out_name]):
+            noise = rng.random((height, width), dtype=np.float32) * 0.05
+            pixels[f"{base_name}{component}"] = (gradient * (0.5 + 0.1 * ((i + j) % 5)) + noise).astype(np.float32)
+    float_channel = Imath.Channel(Imath.PixelType(Imath.PixelType.FLOAT))
+    header["channels"] = {name: float_channel for name in pixels}
+    # 定长的帧标记，发送前逐帧改写（见 tag_payload）
+    header["benchmarkFrame"] = frame_tag(0)
+    exr = OpenEXR.OutputFile(path, header)
+    exr.writePixels({name: data.tobytes() for name, data in pixels.items()})
+    exr.close()
+    return channel_map
+
+class StandInBlender:
+    """代替 Blender 的 HTTP 服务器，记录每张图像到达的时间。"""
+
+    def __init__(self, host="127.0.0.1"):
+        self.arrivals = {}
+        self.cond = threading.Condition()
+        owner = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            # 响应头和响应体分两次写出，不关闭 Nagle 算法会因延迟确认多出约 40 ms
+            disable_nagle_algorithm = True
+
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                with owner.cond:
+                    owner.arrivals[self.headers.get("X-Blender-Image-Name")] = (time.perf_counter(), len(body))
+                    owner.cond.notify_all()
+                self.send_response(200)
+                self.send_header("Content-Length", "2")
+                self.end_headers()
+                self.wfile.write(b"ok")
+
+            def log_message(self, *args):
+                pass
+
+        # 只绑定回环地址；Sender 使用 127.0.0.2 时会走远程模式（只有 127.0.0.1 / localhost 被视为本地）
+        self.server = ThreadingHTTPServer((host, 0), Handler)
+        self.port = self.server.server_address[1]
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def wait_for(self, image_name, timeout=60):
+        with self.cond:
+            self.cond.wait_for(lambda: image_name in self.arrivals, timeout=timeout)
+            return self.arrivals.get(image_name)
+
+def current_rss_mb():
+    """当前进程的常驻内存 (MB)。没有 /proc 的平台退回到进程启动以来的峰值 RSS (ru_maxrss)。"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 1048576
+    except (OSError, ValueError, AttributeError):
+        import resource # Windows 上不可用
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak / 1048576 if sys.platform == "darwin" else peak / 1024
+
+class PeakRssSampler:
+    """在后台线程中每隔 interval 秒采样 RSS，记录每个阶段运行期间（而不是结束时）的峰值。"""
+
+    def __init__(self, interval=0.002):
+        self.interval = interval
+        self.lock = threading.Lock()
+        self.peak = 0.0
+        self.active = threading.Event()
+        threading.Thread(target=self._run, daemon=True).start()
+
+    def _run(self):
+        while True:
+            self.active.wait()
+            self._sample()
+            time.sleep(self.interval)
+
+    def _sample(self):
+        rss = current_rss_mb()
+        with self.lock:
+            self.peak = max(self.peak, rss)
+
+    @contextlib.contextmanager
+    def measure(self, results, stage):
+        """在 with 块运行期间采样，结束后把该阶段的峰值合并到 results[stage]。"""
+        with self.lock:
+            self.peak = 0.0
+        self._sample()
+        self.active.set()
+        try:
+            yield
+        finally:
+            self.active.clear()
+            self._sample()
+            with self.lock:
+                results[stage] = max(results[stage], self.peak)
+
+def percentile_ms(values, p):
+    return float(np.percentile(values, p)) * 1000 if values else 0.0
+
+def run_config(modules, client, blender, sampler, config, args, workdir):
+    hub, receiver, sender, stats = modules
+    import msgspec
+
+    width, height, pass_count, transport = config["width"], config["height"], config["passes"], config["transport"]
+    pass_names = list(hub.COMPONENT_MAP.keys())[:pass_count]
+    session_id = f"bench-{width}x{height}-{pass_count}-{transport}"
+
+    # 预先生成几帧不同的像素数据循环发送；不保留缓存时每帧再改写头部的帧标记使内容唯一
+    payloads = []
+    for seed in range(args.variants):
+        path = os.path.join(workdir, f"{session_id}-{seed}.exr")
+        channel_map = write_synthetic_exr(path, width, height, pass_names, hub.COMPONENT_MAP, args.compression, seed)
+        with open(path, "rb") as f:
+            payloads.append(f.read())
+
+    address = f"http://{args.return_host}:{blender.port}"
+    receiver_node, hub_node, sender_node = receiver.BlenderBridge_Receiver(), hub.BlenderBridge_DataHub(), sender.BlenderBridge_Sender()
+    stats.STATS.reset()
+    hub.FRAME_CACHE.clear()
+    latencies, stage_rss = [], {"receive": 0.0, "decode": 0.0, "send": 0.0}
+
+    started = time.perf_counter()
+    for i in range(args.warmup + args.frames):
+        image_name = f"{session_id}-{i}"
+        metadata = {
+            "type": "interactive", "render_type": "multilayer_exr", "filename": "render.exr",
+            "channel_map": channel_map, "session_id": session_id, "transport": transport,
+            "return_info": {"blender_server_address": address, "image_datablock_name": image_name},
+        }
+        # --cache 测量重复内容的命中，此时按原样循环发送
+        payload = payloads[i % len(payloads)] if args.cache else tag_payload(payloads[i % len(payloads)], i)
+        sent_at = time.perf_counter()
+        with sampler.measure(stage_rss, "receive"):
+            client.send_multipart([msgspec.msgpack.encode(metadata), payload], copy=False)
+            reply = msgspec.msgpack.decode(client.recv())
+            if reply.get("status") != "ok":
+                raise RuntimeError(f"服务器回复了错误: {reply}")
+            pipe = receiver_node.execute(session_id=session_id)[0]
+        if not args.cache:
+            hub.FRAME_CACHE.clear()
+        with sampler.measure(stage_rss, "decode"):
+            outputs = hub_node.execute(pipe, decode_workers=args.decode_workers)
+        with sampler.measure(stage_rss, "send"):
+            sender_node.execute(outputs[0], pipe)
+            arrival = blender.wait_for(image_name)
+        if arrival is None:
+            raise RuntimeError(f"替身 Blender 没有收到 '{image_name}'。")
+        if i == args.warmup - 1:
+            # 预热帧不计入结果
+            stats.STATS.reset()
+            started = time.perf_counter()
+        if i >= args.warmup:
+            latencies.append(arrival[0] - sent_at)
+    elapsed = time.perf_counter() - started
+
+    stages = stats.STATS.snapshot().get(session_id, {})
+    return {
+        **config,
+        "frames": args.frames,
+        "payload_mb": sum(len(p) for p in payloads) / len(payloads) / 1048576,
+        "fps": args.frames / elapsed if elapsed > 0 else 0.0,
+        "e2e_p50_ms": percentile_ms(latencies, 50),
+        "e2e_p99_ms": percentile_ms(latencies, 99),
+        "stages": {
+            stage: {"p50_ms": s["p50"] * 1000, "p99_ms": s["p99"] * 1000, "mb": s["bytes"] / 1048576}
+            for stage, s in stages.items()
+        },
+        "rss_mb": stage_rss,
+    }
+
+def print_report(results):
+    print()
+    print(f"{'配置':<34}{'载荷MB':>8}{'帧/秒':>8}{'p50 ms':>9}{'p99 ms':>9}{'RSS 接收/解码/发送 MB':>26}")
+    for r in results:
+        name = f"{r['width']}x{r['height']} {r['passes']}通道 {r['transport']}"
+        rss = "/".join(f"{r['rss_mb'][k]:.0f}" for k in ("receive", "decode", "send"))
+        print(f"{name:<34}{r['payload_mb']:>8.1f}{r['fps']:>8.2f}{r['e2e_p50_ms']:>9.1f}{r['e2e_p99_ms']:>9.1f}{rss:>26}")
+        for stage, s in r["stages"].items():
+            print(f"    {stage:<18} p50 {s['p50_ms']:>9.2f} ms   p99 {s['p99_ms']:>9.2f} ms   {s['mb']:>9.1f} MB")
+
+def parse_resolutions(text):
+    return [tuple(int(v) for v in item.lower().split("x")) for item in text.split(",") if item]
+
+def main():
+    parser = argparse.ArgumentParser(description="ComfyUI-Blender-Bridge 端到端基准测试")
+    parser.add_argument("--resolutions", default="1280x720,1920x1080", help="逗号分隔的分辨率，例如 1920x1080,3840x2160")
+    parser.add_argument("--passes", default="4,8", help="逗号分隔的通道数 (1-15)")
+    parser.add_argument("--transports", default="memory,disk", help="逗号分隔的传输模式 (memory, disk)")
+    parser.add_argument("--frames", type=int, default=10, help="每个配置计时的帧数")
+    parser.add_argument("--warmup", type=int, default=2, help="每个配置的预热帧数")
+    parser.add_argument("--variants", type=int, default=3, help="每个配置生成的不同 EXR 数量")
+    parser.add_argument("--compression", default="ZIP_COMPRESSION", help="EXR 压缩方式，例如 ZIP_COMPRESSION, PIZ_COMPRESSION, NO_COMPRESSION")
+    parser.add_argument("--decode-workers", type=int, default=0, help="DataHub 的 decode_workers (0 = 自动，即 BLENDER_BRIDGE_DECODE_WORKERS，默认 1)")
+    parser.add_argument("--cache", action="store_true", help="保留 DataHub 的解码缓存（默认每帧清空以测量解码）")
+    parser.add_argument("--address", default="tcp://127.0.0.1:5599", help="基准测试使用的 ZMQ 地址")
+    parser.add_argument("--return-host", default="127.0.0.2", help="替身 Blender 绑定的回环地址；默认 127.0.0.2 走远程模式，127.0.0.1 走本地文件模式")
+    parser.add_argument("--json", help="将结果写入 JSON 文件")
+    parser.add_argument("--verbose", action="store_true", help="显示节点的日志输出（默认隐藏）")
+    args = parser.parse_args()
+    args.warmup = max(1, args.warmup)
+
+    workdir = tempfile.mkdtemp(prefix="blender_bridge_bench_")
+    # 这些设置在节点模块导入时读取
+    os.environ["BLENDER_BRIDGE_ZMQ_ADDRESS"] = args.address
+    os.environ.setdefault("BLENDER_BRIDGE_QUEUE_POLICY", "keep_all")
+    install_folder_paths_stub(workdir)
+    modules = load_bridge_package()
+    hub, receiver = modules[0], modules[1]
+    if not hub.OPENEXR_SUPPORT:
+        sys.exit("需要安装 OpenEXR 才能运行基准测试。")
+
+    import zmq
+    receiver.start_server_thread()
+    client = zmq.Context.instance().socket(zmq.REQ)
+    client.connect(args.address)
+    blender = StandInBlender(args.return_host)
+    sampler = PeakRssSampler()
+
+    configs = [
+        {"width": w, "height": h, "passes": int(p), "transport": t}
+        for (w, h) in parse_resolutions(args.resolutions)
+        for p in args.passes.split(",") if p
+        for t in args.transports.split(",") if t
+    ]
+    results = []
+    # 节点的日志输出会影响计时，默认丢弃；进度写到 stderr
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(sys.stdout if args.verbose else devnull):
+        for config in configs:
+            print(f"[Benchmark] 正在运行 {config} ...", file=sys.stderr, flush=True)
+            results.append(run_config(modules, client, blender, sampler, config, args, workdir))
+
+    print_report(results)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2, ensure_ascii=False)
+        print(f"\n结果已写入 {args.json}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,193 @@
+# nodes/chunked_upload.py
+import os
+import re
+import threading
+import time
+import uuid
+
+# --- 分块上传 ---
+# 超大的 EXR（1 GB+）不再作为单个 ZMQ 消息发送，而是拆分为多个块：
+#   upload_begin  -> 预分配目标（内存缓冲区或临时文件），返回 upload_id
+#   upload_chunk  -> 按 index * chunk_size 的偏移直接写入目标，不在内存中拼接
+#   upload_end    -> 校验所有块都已到达，然后作为普通帧放入会话队列
+# 中断后客户端可以用相同的 upload_id 再次发送 upload_begin / upload_status，
+# 回复中的 missing_chunks 指明需要重发的块（断点续传）。
+
+DEFAULT_CHUNK_SIZE = 8 * 1024 * 1024
+# 超过此时间（秒）没有任何活动的上传会被清理
+UPLOAD_TTL = float(os.environ.get("BLENDER_BRIDGE_UPLOAD_TTL", "600"))
+# 客户端提供的 upload_id 会成为暂存文件名的一部分，只允许安全的字符
+UPLOAD_ID_PATTERN = re.compile(r"[0-9A-Za-z_-]{1,64}")
+
+class UploadError(Exception):
+    """上传请求无效（未知的 upload_id、越界的块等）。"""
+
+class ChunkedUpload:
+    def __init__(self, upload_id, metadata, total_size, chunk_size, path=None):
+        self.upload_id = upload_id
+        self.metadata = metadata
+        self.total_size = total_size
+        self.chunk_size = chunk_size
+        self.chunk_count = max(1, -(-total_size // chunk_size))
+        self.received = set()
+        self.received_bytes = 0
+        self.lock = threading.Lock()
+        # 关闭目标前等待正在进行的写入完成；关闭后到达的块（例如重发的块）会被拒绝
+        self.idle = threading.Condition(self.lock)
+        self.writers = 0
+        self.closed = False
+        self.started = self.touched = time.time()
+        self.path = path
+        if path is None:
+            # 内存目标: 一次性预分配完整缓冲区，各块直接写入对应位置
+            self.buffer = bytearray(total_size)
+            self.fd = None
+        else:
+            # 磁盘目标: 预先设置文件大小，各块按偏移写入
+            self.buffer = None
+            self.fd = os.open(path, os.O_RDWR | os.O_CREAT | os.O_TRUNC | getattr(os, "O_BINARY", 0), 0o644)
+            os.ftruncate(self.fd, total_size)
+
+    def write_chunk(self, index, data):
+        """将第 index 块写入目标。重复的块会被忽略（续传时客户端可能重发）。"""
+        if not 0 <= index < self.chunk_count:
+            raise UploadError(f"块索引 {index} 超出范围 (共 {self.chunk_count} 块)。")
+        offset = index * self.chunk_size
+        expected = min(self.chunk_size, self.total_size - offset)
+        if data.nbytes != expected:
+            raise UploadError(f"块 {index} 的大小为 {data.nbytes} 字节，应为 {expected} 字节。")
+        with self.lock:
+            if self.closed:
+                raise UploadError(f"上传 {self.upload_id} 已结束或已取消。")
+            if index in self.received:
+                return False
+            self.writers += 1
+        try:
+            if self.buffer is not None:
+                # 不同的块写入互不重叠的区域，可以在锁外并行复制
+                memoryview(self.buffer)[offset:offset + expected] = data
+            elif hasattr(os, "pwrite"):
+                written = 0
+                while written < expected:
+                    written += os.pwrite(self.fd, data[written:], offset + written)
+            else:
+                # Windows 没有 os.pwrite，seek + write 需要串行
+                with self.lock:
+                    os.lseek(self.fd, offset, os.SEEK_SET)
+                    os.write(self.fd, data)
+        finally:
+            with self.lock:
+                self.writers -= 1
+                self.idle.notify_all()
+        with self.lock:
+            if index not in self.received:
+                self.received.add(index)
+                self.received_bytes += expected
+            self.touched = time.time()
+        return True
+
+    def missing_chunks(self):
+        with self.lock:
+            return [i for i in range(self.chunk_count) if i not in self.received]
+
+    def is_complete(self):
+        with self.lock:
+            return len(self.received) == self.chunk_count
+
+    def progress(self):
+        with self.lock:
+            return {
+                "upload_id": self.upload_id,
+                "total_size": self.total_size,
+                "chunk_size": self.chunk_size,
+                "chunk_count": self.chunk_count,
+                "received_chunks": len(self.received),
+                "received_bytes": self.received_bytes,
+                "progress": (self.received_bytes / self.total_size) if self.total_size else 1.0,
+                "elapsed": time.time() - self.started,
+            }
+
+    def _close(self):
+        """拒绝新的写入，等待进行中的写入完成后关闭文件描述符（避免写入已关闭或被复用的 fd）。"""
+        with self.lock:
+            self.closed = True
+            self.idle.wait_for(lambda: self.writers == 0)
+            if self.fd is not None:
+                os.close(self.fd)
+                self.fd = None
+
+    def finish(self):
+        """关闭目标并返回数据：内存目标返回 memoryview，磁盘目标返回路径。"""
+        self._close()
+        if self.path is not None:
+            return self.path
+        return memoryview(self.buffer)
+
+    def discard(self):
+        self._close()
+        if self.path and os.path.exists(self.path):
+            os.remove(self.path)
+        self.buffer = None
+
+class UploadManager:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.uploads = {}
+
+    def begin(self, metadata, temp_path_factory=None):
+        """
+        开始（或继续）一个上传。metadata 需要包含 total_size，可选 upload_id 和 chunk_size。
+        temp_path_factory 不为 None 时写入磁盘，否则写入内存。
+        """
+        self.expire()
+        upload_id = str(metadata.get("upload_id") or uuid.uuid4().hex)
+        if not UPLOAD_ID_PATTERN.fullmatch(upload_id):
+            raise UploadError(f"无效的 upload_id: {upload_id!r}（只允许 1-64 个字母、数字、'_' 或 '-'）。")
+        with self.lock:
+            upload = self.uploads.get(upload_id)
+            if upload is not None:
+                # 续传：保留已收到的块
+                upload.touched = time.time()
+                return upload, True
+        total_size = int(metadata.get("total_size", -1))
+        if total_size < 0:
+            raise UploadError("upload_begin 需要 total_size 字段。")
+        chunk_size = int(metadata.get("chunk_size") or DEFAULT_CHUNK_SIZE)
+        if chunk_size <= 0:
+            raise UploadError("chunk_size 必须大于 0。")
+        path = temp_path_factory(upload_id) if temp_path_factory else None
+        upload = ChunkedUpload(upload_id, metadata, total_size, chunk_size, path)
+        with self.lock:
+            self.uploads[upload_id] = upload
+        return upload, False
+
+    def get(self, upload_id):
+        with self.lock:
+            upload = self.uploads.get(str(upload_id))
+        if upload is None:
+            raise UploadError(f"未知的 upload_id: {upload_id}")
+        return upload
+
+    def pop(self, upload_id):
+        with self.lock:
+            return self.uploads.pop(str(upload_id), None)
+
+    def abort(self, upload_id):
+        upload = self.pop(upload_id)
+        if upload is not None:
+            upload.discard()
+        return upload is not None
+
+    def expire(self):
+        """清理长时间没有活动的上传（在 upload_begin、upload_chunk 和 ping 时调用）。"""
+        now = time.time()
+        with self.lock:
+            stale = [uid for uid, u in self.uploads.items() if now - u.touched > UPLOAD_TTL]
+        for upload_id in stale:
+            print(f"[BlenderBridge] 上传 {upload_id} 已超时，正在清理。")
+            self.abort(upload_id)
+
+    def progress(self):
+        with self.lock:
+            uploads = list(self.uploads.values())
+        return {u.upload_id: u.progress() for u in uploads}
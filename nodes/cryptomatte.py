@@ -0,0 +1,246 @@
+# nodes/cryptomatte.py
+import fnmatch
+import json
+import re
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import torch
+
+from .frame_cache import FRAME_CACHE, make_cache_key
+from .hub import OPENEXR_SUPPORT, describe_payload, open_payload, payload_digest
+
+if OPENEXR_SUPPORT:
+    import OpenEXR
+    import Imath
+
+# --- Cryptomatte ---
+# Cryptomatte 层由若干 rank 组成（例如 ViewLayer.CryptoObject00、01、02），每个 rank 的
+# RGBA 通道保存两对 (ID, 覆盖率)。一个像素可能被多个对象部分覆盖，因此必须读取所有 rank
+# 并按覆盖率累加，才能得到正确的软边遮罩。ID 是对象名称 MurmurHash3 的 32 位值按位解释为
+# float32，清单 (manifest) 在 EXR 标头的 cryptomatte/<key>/manifest 中给出名称到十六进制哈希的映射。
+
+# 每帧解析出的层信息（清单索引和通道名称），按内容哈希保留最近几帧；ID/覆盖率平面本身放在 FRAME_CACHE 中
+LAYER_INDEX_HISTORY = 8
+_LAYER_INDEX = OrderedDict()
+_LAYER_INDEX_LOCK = threading.Lock()
+
+def _header_string(value):
+    return value.decode("utf-8") if isinstance(value, bytes) else str(value)
+
+def manifest_index(manifest):
+    """将清单 {名称: 十六进制哈希} 转换为 (名称数组, int32 ID 数组)，一次性完成所有十六进制转换。"""
+    names = list(manifest.keys())
+    hexes = "".join(str(manifest[name]).rjust(8, "0") for name in names)
+    # 大端 uint32 的位模式即为 float32 ID；按 int32 比较可避免浮点比较的误差
+    ids = np.frombuffer(bytes.fromhex(hexes), dtype=">u4").astype(np.uint32).view(np.int32)
+    return np.array(names, dtype=object), ids
+
+def find_cryptomatte_layers(header):
+    """
+    从 EXR 标头中找到所有 Cryptomatte 层，返回 {层名称: {"names", "ids", "pairs"}}。
+    pairs 按 rank 顺序列出 (ID 通道, 覆盖率通道)。
+    """
+    channels = header["channels"]
+    layers = OrderedDict()
+    for key in sorted(header.keys()):
+        if not (key.startswith("cryptomatte/") and key.endswith("/name")):
+            continue
+        prefix = key[:-len("name")]
+        layer_name = _header_string(header[key])
+        manifest_value = header.get(prefix + "manifest")
+        if manifest_value is None:
+            print(f"[BlenderBridge-Cryptomatte] 警告: 层 '{layer_name}' 没有内嵌清单（可能使用了外部 manif_file），已跳过。")
+            continue
+        names, ids = manifest_index(json.loads(_header_string(manifest_value)))
+
+        rank_pattern = re.compile(re.escape(layer_name) + r"(\d\d)\.[RGBA]$")
+        ranks = sorted({m.group(1) for m in (rank_pattern.match(c) for c in channels) if m})
+        pairs = []
+        for rank in ranks:
+            for id_channel, coverage_channel in (("R", "G"), ("B", "A")):
+                pair = (f"{layer_name}{rank}.{id_channel}", f"{layer_name}{rank}.{coverage_channel}")
+                if pair[0] in channels and pair[1] in channels:
+                    pairs.append(pair)
+        layers[layer_name] = {"names": names, "ids": ids, "pairs": pairs}
+    return layers
+
+def select_layer(layers, requested=""):
+    """按名称选择层：完全匹配优先，其次是以 requested 结尾的层（例如 "CryptoMaterial"）；为空时选择第一个。"""
+    if not layers:
+        return None
+    if not requested:
+        return next(iter(layers))
+    if requested in layers:
+        return requested
+    return next((name for name in layers if name.endswith(requested)), None)
+
+def load_layer_index(file_info, content_hash):
+    """返回该帧的 Cryptomatte 层信息和数据窗口尺寸，只在第一次遇到该帧时读取 EXR 标头。"""
+    with _LAYER_INDEX_LOCK:
+        entry = _LAYER_INDEX.get(content_hash)
+        if entry is not None:
+            _LAYER_INDEX.move_to_end(content_hash)
+            return entry
+    header = OpenEXR.InputFile(open_payload(file_info)).header()
+    dw = header["dataWindow"]
+    entry = {
+        "layers": find_cryptomatte_layers(header),
+        "size": (dw.max.y - dw.min.y + 1, dw.max.x - dw.min.x + 1),
+    }
+    with _LAYER_INDEX_LOCK:
+        _LAYER_INDEX[content_hash] = entry
+        while len(_LAYER_INDEX) > LAYER_INDEX_HISTORY:
+            _LAYER_INDEX.popitem(last=False)
+    return entry
+
+def load_rank_planes(file_info, content_hash, layer_name, pairs, size):
+    """
+    一次读取层中所有 rank 的 ID 和覆盖率通道，返回 (rank 对数, 2, H, W) 的 float32 数组。
+    结果按帧缓存，同一帧上的不同遮罩查询不会重复解码。
+    """
+    key = make_cache_key(content_hash, None, "cryptomatte", layer_name)
+    cached, missing = FRAME_CACHE.lookup(key)
+    if missing is not None and not missing:
+        return cached["planes"].numpy()
+
+    height, width = size
+    names = [channel for pair in pairs for channel in pair]
+    raw = OpenEXR.InputFile(open_payload(file_info)).channels(names, Imath.PixelType(Imath.PixelType.FLOAT))
+    planes = np.empty((len(pairs), 2, height, width), dtype=np.float32)
+    for i, buf in enumerate(raw):
+        planes[i // 2, i % 2] = np.frombuffer(buf, dtype=np.float32).reshape(height, width)
+    FRAME_CACHE.store(key, {"planes": torch.from_numpy(planes)}, None)
+    return planes
+
+def parse_patterns(text):
+    """每行（或以逗号分隔）一个对象名称或通配符模式（* 和 ?）。"""
+    return [p.strip() for line in str(text or "").splitlines() for p in line.split(",") if p.strip()]
+
+def match_manifest(names, ids, patterns):
+    """
+    按模式匹配清单中的名称，返回 (目标 ID, 每个 ID 所属的模式序号, 匹配到的名称)。
+    一个对象匹配多个模式时归入第一个模式。
+    """
+    target_ids, labels, matched = [], [], []
+    seen = set()
+    for label, pattern in enumerate(patterns):
+        for i, name in enumerate(names):
+            if name in seen or not fnmatch.fnmatchcase(name, pattern):
+                continue
+            seen.add(name)
+            target_ids.append(ids[i])
+            labels.append(label)
+            matched.append(name)
+    return np.array(target_ids, dtype=np.int32), np.array(labels, dtype=np.int64), matched
+
+def build_masks(planes, target_ids, labels, count):
+    """
+    对所有 rank 一次性计算每个模式的软遮罩，返回 (count, H, W) float32。
+    用排序后的目标 ID 做 searchsorted 查找（即向量化的 np.isin），命中像素的覆盖率按
+    (模式, 像素) 用 bincount 累加，不需要对每个对象单独循环。
+    """
+    ranks, _, height, width = planes.shape
+    if count == 0 or target_ids.size == 0 or ranks == 0:
+        return np.zeros((max(count, 1), height, width), dtype=np.float32)
+    ids = planes[:, 0].view(np.int32)
+    coverage = planes[:, 1]
+
+    order = np.argsort(target_ids)
+    sorted_ids, sorted_labels = target_ids[order], labels[order]
+    position = np.searchsorted(sorted_ids, ids).clip(max=sorted_ids.size - 1)
+    hit = sorted_ids[position] == ids
+
+    pixel = np.broadcast_to(np.arange(height * width).reshape(1, height, width), ids.shape)
+    flat = sorted_labels[position[hit]] * (height * width) + pixel[hit]
+    masks = np.bincount(flat, weights=coverage[hit], minlength=count * height * width)
+    masks = masks.reshape(count, height, width).astype(np.float32)
+    return np.clip(masks, 0.0, 1.0, out=masks)
+
+def extract_cryptomatte_masks(file_info, patterns, layer=""):
+    """
+    为一组名称/通配符模式提取 Cryptomatte 遮罩。
+    返回 (合并遮罩 (1, H, W), 每个模式的遮罩 (N, H, W), 匹配到的名称列表)；失败时返回 None。
+    """
+    content_hash = payload_digest(file_info)
+    if content_hash is None:
+        print(f"[BlenderBridge-Cryptomatte] 错误: 无法读取数据 '{describe_payload(file_info)}'。")
+        return None
+    index = load_layer_index(file_info, content_hash)
+    layer_name = select_layer(index["layers"], layer)
+    if layer_name is None:
+        print(f"[BlenderBridge-Cryptomatte] 错误: 找不到 Cryptomatte 层 '{layer}'。可用的层: {list(index['layers'].keys())}")
+        return None
+    info = index["layers"][layer_name]
+    target_ids, labels, matched = match_manifest(info["names"], info["ids"], patterns)
+    if not matched:
+        print(f"[BlenderBridge-Cryptomatte] 警告: 层 '{layer_name}' 中没有与 {patterns} 匹配的对象。可用对象: {list(info['names'])}")
+
+    key = make_cache_key(content_hash, None, "cryptomatte_mask", layer_name, tuple(patterns))
+    cached, missing = FRAME_CACHE.lookup(key)
+    if missing is not None and not missing:
+        return cached["mask"], cached["masks"], matched
+
+    planes = load_rank_planes(file_info, content_hash, layer_name, info["pairs"], index["size"])
+    masks = build_masks(planes, target_ids, labels, len(patterns))
+    masks = torch.from_numpy(masks)
+    mask = masks.sum(dim=0, keepdim=True).clamp_(0.0, 1.0)
+    FRAME_CACHE.store(key, {"mask": mask, "masks": masks}, None)
+    print(f"[BlenderBridge-Cryptomatte] 已从层 '{layer_name}' 的 {len(info['pairs'])} 个 rank 对中为 {len(matched)} 个对象创建遮罩。")
+    return mask, masks, matched
+
+class BlenderBridge_Cryptomatte:
+    @classmethod
+    def INPUT_TYPES(cls):
+        return {
+            "required": {
+                "bridge_pipe": ("BRIDGE_PIPE",),
+                # 每行（或以逗号分隔）一个对象名称，支持通配符，例如 "Cube*"
+                "matte_names": ("STRING", {"multiline": True, "default": ""}),
+            },
+            # layer: Cryptomatte 层名称或其后缀（"CryptoObject"、"CryptoMaterial"、"CryptoAsset"），为空时使用第一个层
+            "optional": {
+                "layer": ("STRING", {"default": "CryptoObject"}),
+            },
+        }
+
+    RETURN_TYPES = ("MASK", "MASK", "STRING")
+    RETURN_NAMES = ("mask", "masks", "matched_names")
+    FUNCTION = "execute"
+    CATEGORY = "Blender Bridge"
+
+    def execute(self, bridge_pipe, matte_names, layer="CryptoObject"):
+        patterns = parse_patterns(matte_names)
+        files = (bridge_pipe or {}).get("files", [])
+        main_file = files[0] if files else {}
+
+        results = None
+        if not OPENEXR_SUPPORT:
+            print("[BlenderBridge-Cryptomatte] 错误: 未安装 OpenEXR-python，无法提取 Cryptomatte 遮罩。")
+        elif main_file.get("type") != "multilayer_exr":
+            print(f"[BlenderBridge-Cryptomatte] 错误: Cryptomatte 需要多层 EXR，收到的 render_type 为 '{main_file.get('type')}'。")
+        elif not patterns:
+            print("[BlenderBridge-Cryptomatte] 警告: 未指定任何对象名称。")
+        else:
+            # 批处理管道中每帧一个文件，逐帧提取后沿批次维度合并
+            try:
+                results = [extract_cryptomatte_masks(file_info, patterns, layer.strip()) for file_info in files]
+            except Exception as e:
+                print(f"[BlenderBridge-Cryptomatte] 处理 '{describe_payload(main_file)}' 时出错: {e}")
+                results = None
+            if results is not None and any(result is None for result in results):
+                results = None
+
+        if results is None:
+            # 与 DataHub 的占位图像一致，失败时输出空遮罩而不是中断工作流
+            empty = torch.zeros((1, 512, 512), dtype=torch.float32)
+            return (empty, empty, "")
+        if len(results) == 1:
+            mask, masks, matched = results[0]
+            return (mask, masks, "\n".join(matched))
+        # mask 为 (N, H, W)；masks 按帧依次排列每个模式的遮罩，即 (N * 模式数, H, W)
+        mask = torch.cat([result[0] for result in results], dim=0)
+        masks = torch.cat([result[1] for result in results], dim=0)
+        matched = list(dict.fromkeys(name for result in results for name in result[2]))
+        return (mask, masks, "\n".join(matched))
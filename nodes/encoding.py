@@ -0,0 +1,120 @@
+# nodes/encoding.py
+import io
+
+import numpy as np
+from PIL import Image, features
+
+# --- 可选依赖项：lz4 和 zstd 压缩 ---
+# 未安装时相应的压缩方式不可用，协商时会自动跳过。
+try:
+    import lz4.frame
+    LZ4_SUPPORT = True
+except ImportError:
+    LZ4_SUPPORT = False
+
+try:
+    import zstandard
+    ZSTD_SUPPORT = True
+except ImportError:
+    ZSTD_SUPPORT = False
+
+WEBP_SUPPORT = features.check("webp")
+
+# 原始像素载荷的 Content-Type，形状和类型通过 X-Blender-Shape / X-Blender-Dtype 请求头传递
+RAW_CONTENT_TYPE = "application/x-blender-bridge-raw"
+RAW_DTYPES = ("uint8", "float16", "float32")
+COMPRESSIONS = ("none", "lz4", "zstd")
+REMOTE_FORMATS = ("png", "webp", "raw")
+
+def compression_available(method):
+    if method in (None, "", "none"):
+        return True
+    if method == "lz4":
+        return LZ4_SUPPORT
+    if method == "zstd":
+        return ZSTD_SUPPORT
+    return False
+
+def compress(data, method, level=None):
+    """使用指定方式压缩字节数据。method 为 'none' 时原样返回。"""
+    if method in (None, "", "none"):
+        return data
+    if method == "lz4":
+        return lz4.frame.compress(data, compression_level=level if level is not None else 0)
+    if method == "zstd":
+        return zstandard.ZstdCompressor(level=level if level is not None else 3).compress(data)
+    raise ValueError(f"不支持的压缩方式: {method}")
+
+def decompress(data, method):
+    """compress 的逆操作。"""
+    if method in (None, "", "none"):
+        return data
+    if method == "lz4":
+        return lz4.frame.decompress(data)
+    if method == "zstd":
+        return zstandard.ZstdDecompressor().decompress(data)
+    raise ValueError(f"不支持的压缩方式: {method}")
+
+def normalize_format(spec):
+    """将格式描述（字符串或字典）统一为字典，例如 "png" -> {"format": "png"}。"""
+    if isinstance(spec, str):
+        spec = {"format": spec}
+    spec = dict(spec or {})
+    spec["format"] = str(spec.get("format", "png")).lower()
+    return spec
+
+def format_available(spec):
+    fmt = spec["format"]
+    if fmt == "png":
+        return True
+    if fmt == "webp":
+        return WEBP_SUPPORT
+    if fmt == "raw":
+        return spec.get("dtype", "uint8") in RAW_DTYPES and compression_available(spec.get("compression", "none"))
+    return False
+
+def negotiate_format(return_info, requested="auto"):
+    """
+    选择远程模式的载荷格式。requested 不是 "auto" 时直接使用节点上选择的格式；
+    否则按 return_info["accept_formats"] 中 Blender 声明的偏好顺序，选择第一个本机可用的格式。
+    都不可用时退回 PNG。
+    """
+    if requested and requested != "auto":
+        candidates = [requested]
+    else:
+        candidates = (return_info or {}).get("accept_formats") or ["png"]
+    for candidate in candidates:
+        spec = normalize_format(candidate)
+        if format_available(spec):
+            return spec
+        print(f"[BlenderBridge-Sender] 警告: 载荷格式 {spec} 在本机不可用，尝试下一个。")
+    return {"format": "png"}
+
+def encode_image(array, spec, compress_level=6):
+    """
+    将 (H, W, C) 数组编码为远程载荷，返回 (payload, headers)。
+    调用方负责按格式准备数组: PNG/WebP 需要 uint8，raw 需要 spec["dtype"] 指定的类型。
+    """
+    fmt = spec["format"]
+    if fmt == "raw":
+        dtype = spec.get("dtype", "uint8")
+        compression = spec.get("compression", "none")
+        raw = np.ascontiguousarray(array, dtype=dtype)
+        payload = compress(memoryview(raw).cast("B"), compression, spec.get("level"))
+        headers = {
+            "Content-Type": RAW_CONTENT_TYPE,
+            "X-Blender-Shape": ",".join(str(d) for d in raw.shape),
+            "X-Blender-Dtype": dtype,
+        }
+        if compression not in (None, "", "none"):
+            headers["Content-Encoding"] = compression
+        # 未压缩时 payload 是 raw 的零拷贝视图，http.client 可以直接发送
+        return payload, headers
+
+    pil_image = Image.fromarray(np.ascontiguousarray(array, dtype=np.uint8), 'RGB')
+    buffer = io.BytesIO()
+    if fmt == "webp":
+        pil_image.save(buffer, format="WEBP", lossless=True, quality=spec.get("quality", 50), method=spec.get("method", 0))
+        return buffer.getvalue(), {"Content-Type": "image/webp"}
+    pil_image.save(buffer, format="PNG", compress_level=spec.get("compress_level", compress_level))
+    return buffer.getvalue(), {"Content-Type": "image/png"}
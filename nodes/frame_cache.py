@@ -0,0 +1,144 @@
+# nodes/frame_cache.py
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+
+# --- 已解码帧缓存 ---
+# Blender 经常重复发送完全相同的渲染结果（例如只修改了提示词）。
+# 此缓存以"数据内容哈希 + channel_map"为键，保存已解码的通道张量，
+# 命中时 DataHub 可以跳过整个 EXR 解码过程。
+
+# --- 可选依赖项：xxhash ---
+# 安装后使用 xxh3-128 计算内容哈希（比 blake2b 快一个数量级以上），未安装时回退到 blake2b。
+try:
+    import xxhash
+    XXHASH_SUPPORT = True
+except ImportError:
+    XXHASH_SUPPORT = False
+
+# 缓存的内存预算 (MB)，设置为 0 可禁用缓存
+DEFAULT_CACHE_BUDGET_MB = int(os.environ.get("BLENDER_BRIDGE_CACHE_MB", "1024"))
+
+def compute_content_hash(data):
+    """计算数据缓冲区的 128 位内容哈希（xxh3-128，未安装 xxhash 时为 blake2b）。对于大缓冲区，hashlib 会释放 GIL。"""
+    if XXHASH_SUPPORT:
+        return xxhash.xxh3_128_hexdigest(data)
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+def make_cache_key(content_hash, metadata, *options):
+    """根据内容哈希、channel_map 以及额外的解码选项构建缓存键。"""
+    channel_map = (metadata or {}).get("channel_map") or {}
+    return (content_hash, json.dumps(channel_map, sort_keys=True)) + tuple(options)
+
+def tensor_nbytes(tensors):
+    """计算一组张量实际占用的内存字节数（共享同一存储的张量只计算一次）。"""
+    seen = set()
+    total = 0
+    for t in tensors:
+        if t is None:
+            continue
+        storage = t.untyped_storage()
+        if storage.data_ptr() in seen:
+            continue
+        seen.add(storage.data_ptr())
+        total += storage.nbytes()
+    return total
+
+class DecodedFrameCache:
+    """
+    带内存预算的 LRU 缓存。每个条目保存:
+      - passes:    {输出名称: 张量}
+      - attempted: 已尝试解码的输出名称集合（None 表示已解码全部通道）
+    """
+
+    def __init__(self, budget_mb=DEFAULT_CACHE_BUDGET_MB):
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+        self.budget_bytes = max(0, int(budget_mb)) * 1024 * 1024
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def lookup(self, key, wanted=None):
+        """
+        查找缓存条目，返回 (已缓存的通道, 仍需解码的通道)。
+        仍需解码的通道为空集合表示缓存命中；为 None 表示需要解码全部通道。
+        """
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return {}, wanted
+            self.entries.move_to_end(key)
+            attempted = entry["attempted"]
+            if attempted is None or (wanted is not None and wanted <= attempted):
+                self.hits += 1
+                return dict(entry["passes"]), set()
+            self.misses += 1
+            missing = None if wanted is None else wanted - attempted
+            return dict(entry["passes"]), missing
+
+    @property
+    def enabled(self):
+        """预算为 0 时缓存被禁用，不需要为查找计算内容哈希。"""
+        return self.budget_bytes > 0
+
+    def store(self, key, passes, attempted):
+        """合并并保存解码结果，然后按 LRU 顺序淘汰超出预算的条目。"""
+        if self.budget_bytes <= 0:
+            return
+        with self.lock:
+            entry = self.entries.pop(key, None)
+            if entry is not None:
+                self.total_bytes -= entry["nbytes"]
+                merged = dict(entry["passes"])
+                merged.update(passes)
+                if entry["attempted"] is None or attempted is None:
+                    attempted = None
+                else:
+                    attempted = entry["attempted"] | attempted
+                passes = merged
+            nbytes = tensor_nbytes(passes.values())
+            if nbytes > self.budget_bytes:
+                print(f"[BlenderBridge-Cache] 帧大小 ({nbytes / 1048576:.1f} MB) 超出缓存预算，不进行缓存。")
+                return
+            self.entries[key] = {"passes": dict(passes), "attempted": attempted, "nbytes": nbytes}
+            self.total_bytes += nbytes
+            while self.total_bytes > self.budget_bytes and self.entries:
+                _, evicted = self.entries.popitem(last=False)
+                self.total_bytes -= evicted["nbytes"]
+                self.evictions += 1
+
+    def set_budget(self, budget_mb):
+        """修改内存预算，并立即淘汰超出部分。"""
+        with self.lock:
+            self.budget_bytes = max(0, int(budget_mb)) * 1024 * 1024
+            while self.total_bytes > self.budget_bytes and self.entries:
+                _, evicted = self.entries.popitem(last=False)
+                self.total_bytes -= evicted["nbytes"]
+                self.evictions += 1
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.total_bytes = 0
+
+    def stats(self):
+        """返回缓存的命中/未命中统计信息。"""
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self.entries),
+                "bytes": self.total_bytes,
+                "budget_bytes": self.budget_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": (self.hits / lookups) if lookups else 0.0,
+            }
+
+# 全局缓存实例，由所有 DataHub 节点共享
+FRAME_CACHE = DecodedFrameCache()
@@ -0,0 +1,124 @@
+# nodes/frame_delta.py
+import os
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+from .encoding import compression_available, decompress
+from .frame_cache import compute_content_hash
+
+# --- 脏矩形增量更新 ---
+# 交互式调整时，两帧之间通常只有一小块区域发生变化。对于原始通道格式 (raw_passes)，
+# Blender 可以只发送变化的矩形：元数据中的 base_frame_id 指向之前的一帧，
+# rects 列表描述每个矩形所属的通道和位置。Receiver 将矩形写入基准帧的副本，
+# 没有变化的通道直接沿用基准帧的缓冲区和哈希，DataHub 因此可以复用其已转换的张量。
+
+# 每个会话保留的最近完整帧数量（可作为增量的基准帧）
+DELTA_HISTORY = int(os.environ.get("BLENDER_BRIDGE_DELTA_HISTORY", "2"))
+
+class DeltaError(Exception):
+    """基准帧不存在或已被淘汰，Blender 应重新发送完整帧。"""
+
+def combine_pass_digests(pass_infos):
+    """由各通道的描述和哈希组合出整帧的内容哈希。"""
+    return compute_content_hash("|".join(
+        f"{p['name']}:{p['dtype']}:{p['shape']}:{p['compression']}:{p['flip_y']}:{p['digest']}" for p in pass_infos
+    ).encode("utf-8"))
+
+class RetainedFrames:
+    """按会话保存最近的原始通道帧，键为 frame_id。"""
+
+    def __init__(self, history=DELTA_HISTORY):
+        self.lock = threading.Lock()
+        self.sessions = {}
+        self.history = max(1, int(history))
+
+    def retain(self, session_id, frame_id, file_info):
+        with self.lock:
+            frames = self.sessions.setdefault(session_id, OrderedDict())
+            frames.pop(str(frame_id), None)
+            frames[str(frame_id)] = file_info
+            while len(frames) > self.history:
+                frames.popitem(last=False)
+
+    def get(self, session_id, frame_id):
+        with self.lock:
+            file_info = self.sessions.get(session_id, {}).get(str(frame_id))
+        if file_info is None:
+            raise DeltaError(f"会话 '{session_id}' 中找不到基准帧 {frame_id}。")
+        return file_info
+
+    def stats(self):
+        with self.lock:
+            return {session_id: list(frames.keys()) for session_id, frames in self.sessions.items()}
+
+def patch_pass(pass_info, changes):
+    """
+    将一组矩形写入通道数据的副本，返回新的通道信息。
+    矩形坐标与通道数据的存储顺序一致（flip_y 时第 0 行是图像底部）。
+    """
+    dtype = np.dtype(pass_info["dtype"])
+    array = np.frombuffer(
+        decompress(pass_info["data"], pass_info.get("compression", "none")), dtype=dtype
+    ).reshape(pass_info["shape"]).copy()
+    view = array if array.ndim == 3 else array[..., None]
+    height, width, components = view.shape
+    # 基准帧没有哈希（解码缓存被禁用）时，矩形和新通道也不计算哈希
+    hashing = pass_info["digest"] is not None
+
+    rects = []
+    for desc, buffer in changes:
+        x, y = int(desc.get("x", 0)), int(desc.get("y", 0))
+        w, h = int(desc["width"]), int(desc["height"])
+        if x < 0 or y < 0 or x + w > width or y + h > height:
+            raise ValueError(f"矩形 ({x}, {y}, {w}, {h}) 超出通道 '{pass_info['name']}' 的范围 ({width}x{height})。")
+        data = np.frombuffer(decompress(buffer, desc.get("compression", "none")), dtype=dtype).reshape(h, w, components)
+        view[y:y + h, x:x + w] = data
+        rects.append({"x": x, "y": y, "width": w, "height": h, "data": data, "digest": compute_content_hash(buffer) if hashing else None})
+
+    # 新哈希由基准哈希和各矩形的哈希组合而成，不需要重新哈希整个通道
+    digest = compute_content_hash("|".join(
+        [pass_info["digest"]] + [f"{r['x']},{r['y']},{r['width']},{r['height']}:{r['digest']}" for r in rects]
+    ).encode("utf-8")) if hashing else None
+    return {
+        **pass_info,
+        "compression": "none",
+        "digest": digest,
+        "data": memoryview(array).cast("B"),
+        # DataHub 在基准通道的张量已缓存时，只转换这些矩形
+        "patch": {
+            "base_digest": pass_info["digest"],
+            "base_compression": pass_info.get("compression", "none"),
+            "rects": rects,
+        },
+    }
+
+def apply_delta(base_info, metadata, parts):
+    """
+    将增量消息应用到基准帧，返回合并后的原始通道帧信息。
+    metadata["rects"] 按顺序描述 parts[1:] 中的每个矩形: pass, x, y, width, height, 可选 compression。
+    """
+    rects = metadata.get("rects") or []
+    if len(parts) - 1 != len(rects):
+        raise ValueError(f"增量请求声明了 {len(rects)} 个矩形，但收到了 {len(parts) - 1} 个数据部分。")
+    changes = {}
+    for desc, part in zip(rects, parts[1:]):
+        if not compression_available(desc.get("compression") or "none"):
+            raise ValueError(f"矩形的压缩方式 '{desc.get('compression')}' 在本机不可用。")
+        changes.setdefault(str(desc["pass"]), []).append((desc, part.buffer))
+    unknown = set(changes) - {p["name"] for p in base_info["passes"]}
+    if unknown:
+        raise DeltaError(f"基准帧中没有通道: {sorted(unknown)}")
+
+    passes = [
+        patch_pass(p, changes[p["name"]]) if p["name"] in changes else p
+        for p in base_info["passes"]
+    ]
+    return {
+        **base_info,
+        "size": sum(p["data"].nbytes for p in passes),
+        "content_hash": combine_pass_digests(passes) if base_info.get("content_hash") else None,
+        "passes": passes,
+        "delta_bytes": sum(part.buffer.nbytes for part in parts[1:]),
+    }
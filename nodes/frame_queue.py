@@ -0,0 +1,158 @@
+# nodes/frame_queue.py
+import os
+import threading
+import time
+from collections import deque
+
+# --- 帧队列 ---
+# 服务器线程与 Receiver 节点之间的有界帧队列，每帧带有递增的序列号。
+# 支持三种策略:
+#   "latest":   只保留最新的一帧，新帧到达时丢弃未消费的旧帧（交互模式）
+#   "keep_all": 按顺序保留所有帧（动画/批处理）；队列满时丢弃最旧的帧并计数
+#   "block":    队列满时阻塞发送方，直到 Receiver 消费了一帧（通过延迟 ZMQ 回复实现背压）
+#               提供 on_admit 回调时，帧在队列外挂起而不占用调用线程，有空位时再入队并调用回调
+QUEUE_POLICIES = ("latest", "keep_all", "block")
+
+DEFAULT_QUEUE_POLICY = os.environ.get("BLENDER_BRIDGE_QUEUE_POLICY", "latest").lower()
+if DEFAULT_QUEUE_POLICY not in QUEUE_POLICIES:
+    print(f"[BlenderBridge] 警告: 未知的队列策略 '{DEFAULT_QUEUE_POLICY}'，将使用 'latest'。")
+    DEFAULT_QUEUE_POLICY = "latest"
+DEFAULT_QUEUE_SIZE = int(os.environ.get("BLENDER_BRIDGE_QUEUE_SIZE", "8"))
+# "block" 策略下发送方最长等待时间（秒），超时后回复 busy，避免 Blender 无限等待
+DEFAULT_BLOCK_TIMEOUT = float(os.environ.get("BLENDER_BRIDGE_BLOCK_TIMEOUT", "30"))
+
+class QueueFullError(Exception):
+    """"block" 策略下等待空位超时。"""
+
+class FrameQueue:
+    def __init__(self, maxlen=DEFAULT_QUEUE_SIZE, policy=DEFAULT_QUEUE_POLICY):
+        self.cond = threading.Condition()
+        self.frames = deque()
+        # "block" 策略下等待空位的帧: {"frame", "on_admit", "deadline"}
+        self.waiting = deque()
+        self.maxlen = max(1, int(maxlen))
+        self.policy = policy
+        self.next_sequence = 1
+        self.received = 0
+        self.consumed = 0
+        self.dropped = 0
+
+    def configure(self, maxlen=None, policy=None):
+        """修改队列容量或策略。缩小容量时，多余的旧帧按丢弃计数。"""
+        with self.cond:
+            if policy is not None:
+                if policy not in QUEUE_POLICIES:
+                    raise ValueError(f"未知的队列策略: {policy}")
+                self.policy = policy
+            if maxlen is not None:
+                self.maxlen = max(1, int(maxlen))
+            self._trim(self.maxlen)
+            admitted = self._admit_waiting()
+            self.cond.notify_all()
+        self._notify(admitted)
+
+    def _trim(self, limit):
+        while len(self.frames) > limit:
+            self.frames.popleft()
+            self.dropped += 1
+
+    def _append(self, frame):
+        """按当前策略腾出空间后追加一帧，分配序列号并返回（需持有锁）。"""
+        if self.policy == "latest":
+            self._trim(0)
+        elif self.policy == "keep_all":
+            self._trim(self.maxlen - 1)
+        sequence = self.next_sequence
+        self.next_sequence += 1
+        frame["sequence"] = sequence
+        self.frames.append(frame)
+        self.received += 1
+        self.cond.notify_all()
+        return sequence
+
+    def _admit_waiting(self):
+        """将挂起的帧按顺序移入有空位的队列，返回待调用的 [(on_admit, 序列号)]（需持有锁）。"""
+        admitted = []
+        while self.waiting and (self.policy != "block" or len(self.frames) < self.maxlen):
+            entry = self.waiting.popleft()
+            admitted.append((entry["on_admit"], self._append(entry["frame"])))
+        return admitted
+
+    @staticmethod
+    def _notify(admitted):
+        # 在锁外调用回调，回调可能发送网络回复
+        for on_admit, sequence in admitted:
+            on_admit(sequence)
+
+    def put(self, frame, timeout=DEFAULT_BLOCK_TIMEOUT, on_admit=None):
+        """
+        将一帧放入队列，并为其分配序列号 (frame["sequence"])。返回该序列号。
+        "block" 策略下队列已满时：提供了 on_admit 则挂起该帧并立即返回 None，之后以序列号调用
+        on_admit(sequence)，超时则以 None 调用；否则在当前线程中等待，超时抛出 QueueFullError。
+        """
+        with self.cond:
+            if self.policy == "block" and (self.waiting or len(self.frames) >= self.maxlen):
+                if on_admit is not None:
+                    self.waiting.append({"frame": frame, "on_admit": on_admit, "deadline": time.monotonic() + timeout})
+                    return None
+                if not self.cond.wait_for(lambda: len(self.frames) < self.maxlen, timeout=timeout):
+                    raise QueueFullError(f"帧队列已满 ({self.maxlen})，等待 {timeout} 秒后超时。")
+            return self._append(frame)
+
+    def expire_waiting(self, now=None):
+        """以 None 调用等待超时的挂起帧的回调。返回剩余挂起帧中最早的截止时间，没有时返回 None。"""
+        now = time.monotonic() if now is None else now
+        expired = []
+        with self.cond:
+            while self.waiting and self.waiting[0]["deadline"] <= now:
+                expired.append((self.waiting.popleft()["on_admit"], None))
+            next_deadline = min((entry["deadline"] for entry in self.waiting), default=None)
+        self._notify(expired)
+        return next_deadline
+
+    def get(self, timeout=None):
+        """取出最旧的一帧。队列为空时等待，超时返回 None。"""
+        with self.cond:
+            if not self.cond.wait_for(lambda: self.frames, timeout=timeout):
+                return None
+            frame = self.frames.popleft()
+            self.consumed += 1
+            # 唤醒可能因队列已满而阻塞的发送方，并让挂起的帧入队
+            admitted = self._admit_waiting()
+            self.cond.notify_all()
+        self._notify(admitted)
+        return frame
+
+    def get_batch(self, count, timeout=None, gather_timeout=0.0):
+        """
+        取出最多 count 帧（按顺序）。等待第一帧的方式与 get 相同，之后最多再等待 gather_timeout 秒凑齐 count 帧；
+        超时后返回已到达的帧。队列为空且超时返回空列表。
+        """
+        with self.cond:
+            if not self.cond.wait_for(lambda: self.frames, timeout=timeout):
+                return []
+            if gather_timeout > 0:
+                self.cond.wait_for(lambda: len(self.frames) >= count, timeout=gather_timeout)
+            batch = [self.frames.popleft() for _ in range(min(count, len(self.frames)))]
+            self.consumed += len(batch)
+            admitted = self._admit_waiting()
+            self.cond.notify_all()
+        self._notify(admitted)
+        return batch
+
+    def has_data(self):
+        with self.cond:
+            return bool(self.frames)
+
+    def stats(self):
+        with self.cond:
+            return {
+                "policy": self.policy,
+                "depth": len(self.frames),
+                "waiting": len(self.waiting),
+                "capacity": self.maxlen,
+                "received": self.received,
+                "consumed": self.consumed,
+                "dropped": self.dropped,
+                "last_sequence": self.next_sequence - 1,
+            }
@@ -0,0 +1,243 @@
+# nodes/frame_store.py
+import mmap
+import os
+import threading
+import time
+import uuid
+import weakref
+from collections import OrderedDict
+
+import folder_paths
+
+from .frame_cache import compute_content_hash
+
+# --- 受管理的帧存储 ---
+# 磁盘传输模式下接收到的帧、分块上传的临时文件以及 Sender 本地文件模式的 PNG 都写入这里，
+# 而不是在临时/输出目录中无限累积：
+#   - 文件以 "<内容哈希>_<文件名>" 命名，相同内容只存储一份（去重）
+#   - 每个文件有引用计数：FrameRef 对象随 bridge_pipe 传递，被回收时自动释放引用
+#   - 不再被引用的文件按 LRU 顺序淘汰，直到总大小低于预算；超过最长保留时间的也会被删除
+# 仍被引用的文件永远不会被删除，即使总大小超出预算。
+
+DEFAULT_TEMP_STORE_MB = int(os.environ.get("BLENDER_BRIDGE_TEMP_STORE_MB", "2048"))
+DEFAULT_OUTPUT_STORE_MB = int(os.environ.get("BLENDER_BRIDGE_OUTPUT_STORE_MB", "1024"))
+# 不再被引用的文件最长保留时间（秒），0 表示只按大小淘汰
+DEFAULT_MAX_AGE = float(os.environ.get("BLENDER_BRIDGE_STORE_MAX_AGE", "3600"))
+# 固定引用的数量上限和空闲时间（秒，0 表示不按时间释放）。超出上限的最久未使用的 key、
+# 或超过空闲时间没有新结果的 key 会释放其引用，文件之后按预算正常淘汰
+DEFAULT_MAX_PINS = max(1, int(os.environ.get("BLENDER_BRIDGE_STORE_PINS", "64")))
+DEFAULT_PIN_IDLE = float(os.environ.get("BLENDER_BRIDGE_STORE_PIN_IDLE", "300"))
+STAGING_SUFFIX = ".part"
+
+def hash_file(path):
+    """计算文件的内容哈希（与 compute_content_hash 一致），通过 mmap 读取，不把整个文件载入内存。"""
+    if os.path.getsize(path) == 0:
+        return compute_content_hash(b"")
+    with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+        return compute_content_hash(mapped)
+
+class FrameRef:
+    """对存储中一个文件的引用。调用 release() 或对象被回收时释放引用。"""
+
+    def __init__(self, store, content_hash, path, entry=None):
+        self.content_hash = content_hash
+        self.path = path
+        # 记住引用的是哪个条目：文件丢失后条目会被重新登记，旧引用不应减少新条目的计数
+        self._finalizer = weakref.finalize(self, store.release, content_hash, entry)
+
+    def release(self):
+        self._finalizer()
+
+    def __repr__(self):
+        return f"FrameRef({self.path})"
+
+class FrameStore:
+    def __init__(self, directory_factory, budget_mb, max_age=DEFAULT_MAX_AGE, name="store",
+                 max_pins=DEFAULT_MAX_PINS, pin_idle=DEFAULT_PIN_IDLE):
+        self.directory_factory = directory_factory
+        self.directory = None
+        self.budget_bytes = max(0, int(budget_mb)) * 1024 * 1024
+        self.max_age = max_age
+        self.max_pins = max(1, int(max_pins))
+        self.pin_idle = pin_idle
+        self.name = name
+        self.lock = threading.Lock()
+        # content_hash -> {"path", "size", "refs", "last_used"}，按最近使用顺序排列
+        self.entries = OrderedDict()
+        # 每个 key（例如目标图像名称）固定的最新引用: key -> {"ref", "last_used"}，按最近使用顺序排列
+        self.pinned = OrderedDict()
+        self.total_bytes = 0
+        self.deduplicated = 0
+        self.evicted = 0
+
+    def _ensure_directory(self):
+        """第一次使用时创建目录，并登记上次运行留下的文件（作为未引用的条目，之后按预算淘汰）。"""
+        if self.directory is not None:
+            return self.directory
+        directory = self.directory_factory()
+        os.makedirs(directory, exist_ok=True)
+        leftovers = []
+        for entry in os.scandir(directory):
+            if not entry.is_file():
+                continue
+            if entry.name.endswith(STAGING_SUFFIX) or entry.name.endswith(".tmp"):
+                # 中断的上传或写入
+                self._remove(entry.path)
+                continue
+            content_hash = entry.name.split("_", 1)[0]
+            stat = entry.stat()
+            leftovers.append((stat.st_mtime, content_hash, entry.path, stat.st_size))
+        for mtime, content_hash, path, size in sorted(leftovers):
+            if content_hash in self.entries:
+                continue
+            self.entries[content_hash] = {"path": path, "size": size, "refs": 0, "last_used": mtime}
+            self.total_bytes += size
+        self.directory = directory
+        return directory
+
+    def _path_for(self, content_hash, filename):
+        return os.path.join(self.directory, f"{content_hash}_{os.path.basename(str(filename))}")
+
+    def _acquire_existing(self, content_hash):
+        """如果内容已存在，增加引用并返回 FrameRef（需持有锁）。"""
+        entry = self.entries.get(content_hash)
+        if entry is None:
+            return None
+        if not os.path.exists(entry["path"]):
+            # 文件已被外部删除：丢弃过期的条目，调用方会重新写入并登记
+            del self.entries[content_hash]
+            self.total_bytes -= entry["size"]
+            return None
+        entry["refs"] += 1
+        entry["last_used"] = time.time()
+        self.entries.move_to_end(content_hash)
+        self.deduplicated += 1
+        return FrameRef(self, content_hash, entry["path"], entry)
+
+    def _register(self, content_hash, path):
+        size = os.path.getsize(path)
+        entry = self.entries[content_hash] = {"path": path, "size": size, "refs": 1, "last_used": time.time()}
+        self.total_bytes += size
+        return FrameRef(self, content_hash, path, entry)
+
+    def put_bytes(self, data, filename, content_hash=None):
+        """将数据写入存储并返回 FrameRef。相同内容已存在时直接复用，不再写入磁盘。"""
+        content_hash = content_hash or compute_content_hash(data)
+        with self.lock:
+            self._ensure_directory()
+            ref = self._acquire_existing(content_hash)
+        if ref is None:
+            path = self._path_for(content_hash, filename)
+            # 先写入临时文件再重命名，读取方不会看到写了一半的文件
+            temp_path = os.path.join(self.directory, f".{uuid.uuid4().hex}.tmp")
+            with open(temp_path, "wb") as f:
+                f.write(data)
+            with self.lock:
+                ref = self._acquire_existing(content_hash)
+                if ref is None:
+                    os.replace(temp_path, path)
+                    ref = self._register(content_hash, path)
+                else:
+                    self._remove(temp_path)
+        self.evict()
+        return ref
+
+    def staging_path(self, staging_id, filename):
+        """返回一个在存储目录中写入数据的暂存路径（例如分块上传），完成后用 adopt 登记。"""
+        with self.lock:
+            directory = self._ensure_directory()
+        # staging_id 和 filename 都可能来自客户端，只保留最后一级名称，防止写到存储目录之外
+        name = f"{os.path.basename(str(staging_id))}_{os.path.basename(str(filename))}{STAGING_SUFFIX}"
+        return os.path.join(directory, name)
+
+    def adopt(self, path, filename):
+        """将一个已写好的文件（通常来自 staging_path）纳入存储并返回 FrameRef。重复的内容会删除该文件。"""
+        content_hash = hash_file(path)
+        with self.lock:
+            self._ensure_directory()
+            ref = self._acquire_existing(content_hash)
+            if ref is None:
+                target = self._path_for(content_hash, filename)
+                os.replace(path, target)
+                ref = self._register(content_hash, target)
+            else:
+                self._remove(path)
+        self.evict()
+        return ref
+
+    def pin(self, key, ref):
+        """
+        为 key 固定最新的引用，并释放该 key 之前固定的引用（例如 Blender 可能仍在读取的最新结果）。
+        同时释放超出 max_pins 或空闲超过 pin_idle 秒的其他 key 的引用，固定的引用不会无限累积。
+        """
+        now = time.monotonic()
+        released = []
+        with self.lock:
+            previous = self.pinned.pop(key, None)
+            if previous is not None and previous["ref"] is not ref:
+                released.append(previous["ref"])
+            self.pinned[key] = {"ref": ref, "last_used": now}
+            for other, entry in list(self.pinned.items()):
+                if other == key:
+                    continue
+                idle = self.pin_idle > 0 and now - entry["last_used"] > self.pin_idle
+                if not idle and len(self.pinned) <= self.max_pins:
+                    continue
+                released.append(self.pinned.pop(other)["ref"])
+        for old_ref in released:
+            old_ref.release()
+
+    def release(self, content_hash, entry=None):
+        with self.lock:
+            current = self.entries.get(content_hash)
+            if current is not None and (entry is None or current is entry) and current["refs"] > 0:
+                current["refs"] -= 1
+                current["last_used"] = time.time()
+        self.evict()
+
+    def evict(self):
+        """删除未被引用且超过保留时间的文件，然后按 LRU 顺序删除未被引用的文件直到低于预算。"""
+        removed = []
+        with self.lock:
+            now = time.time()
+            for content_hash, entry in list(self.entries.items()):
+                if entry["refs"] > 0:
+                    continue
+                expired = self.max_age > 0 and now - entry["last_used"] > self.max_age
+                if not expired and self.total_bytes <= self.budget_bytes:
+                    continue
+                del self.entries[content_hash]
+                self.total_bytes -= entry["size"]
+                self.evicted += 1
+                removed.append(entry["path"])
+        for path in removed:
+            self._remove(path)
+
+    def _remove(self, path):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            # Windows 上文件可能仍被打开
+            print(f"[BlenderBridge-Store] 无法删除 {path}: {e}")
+
+    def stats(self):
+        with self.lock:
+            return {
+                "files": len(self.entries),
+                "bytes": self.total_bytes,
+                "budget_bytes": self.budget_bytes,
+                "referenced": sum(1 for e in self.entries.values() if e["refs"] > 0),
+                "pinned": len(self.pinned),
+                "deduplicated": self.deduplicated,
+                "evicted": self.evicted,
+            }
+
+# Receiver 的磁盘传输和分块上传使用临时目录，Sender 的本地文件模式使用输出目录
+TEMP_STORE = FrameStore(
+    lambda: os.path.join(folder_paths.get_temp_directory(), "blender_bridge"), DEFAULT_TEMP_STORE_MB, name="temp",
+)
+OUTPUT_STORE = FrameStore(
+    lambda: os.path.join(folder_paths.get_output_directory(), "blender_bridge"), DEFAULT_OUTPUT_STORE_MB, name="output",
+)
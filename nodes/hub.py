@@ -2,12 +2,17 @@
 import torch
 import numpy as np
 from PIL import Image
+import io
 import os
-import json
-import struct
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 import folder_paths
+from .frame_cache import FRAME_CACHE, compute_content_hash, make_cache_key
+from .encoding import decompress
+from .stats import STATS
 
-# --- 可选依赖项：Cryptomatte 和 EXR 通道支持 ---
+# --- 可选依赖项：EXR 多通道和 Cryptomatte 支持 (Cryptomatte 节点见 cryptomatte.py) ---
 # 尝试导入 OpenEXR 和 Imath。如果它们不可用，
 # EXR 相关功能将被禁用，并会打印一条警告。
 try:
@@ -19,70 +24,221 @@ except ImportError:
     print("[BlenderBridge-DataHub] 请在您的 ComfyUI Python 环境中运行: pip install OpenEXR-python")
     OPENEXR_SUPPORT = False
 
-def pil_to_tensor(image_pil):
+class MemoryReader(io.RawIOBase):
+    """基于内存缓冲区（例如 zmq.Frame 的 memoryview）的只读文件对象，读取时不复制整个缓冲区。"""
+
+    def __init__(self, buffer):
+        super().__init__()
+        self._view = memoryview(buffer).cast("B")
+        self._pos = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def read(self, size=-1):
+        # OpenEXR 的绑定只调用 read(n) 和 tell()。RawIOBase 的默认实现会先分配并清零 bytearray，
+        # 经 Python 层的 readinto 复制，再转换为 bytes（共三遍）；这里直接用 tobytes 在 C 层复制一次
+        end = len(self._view) if size is None or size < 0 else min(len(self._view), self._pos + size)
+        data = self._view[self._pos:end].tobytes() if end > self._pos else b""
+        self._pos += len(data)
+        return data
+
+    def readall(self):
+        return self.read()
+
+    def readinto(self, b):
+        n = max(0, min(len(b), len(self._view) - self._pos))
+        b[:n] = self._view[self._pos:self._pos + n]
+        self._pos += n
+        return n
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_SET:
+            self._pos = offset
+        elif whence == io.SEEK_CUR:
+            self._pos += offset
+        elif whence == io.SEEK_END:
+            self._pos = len(self._view) + offset
+        else:
+            raise ValueError(f"无效的 whence: {whence}")
+        return self._pos
+
+    def tell(self):
+        return self._pos
+
+def open_payload(file_info):
+    """返回文件信息对应的数据源：内存中的数据返回 MemoryReader，否则返回磁盘路径。"""
+    data = file_info.get("data")
+    if data is not None:
+        return MemoryReader(data)
+    return file_info.get("path")
+
+def describe_payload(file_info):
+    """返回用于日志输出的数据源描述。"""
+    if file_info.get("path"):
+        return file_info["path"]
+    return f"<内存: {file_info.get('original_name', 'payload')}>"
+
+# --- 张量转换层 ---
+# 每个输出通道只分配一次内存：各分量直接写入一个预分配的连续缓冲区，
+# 然后原地裁剪到 [0, 1]。单分量通道 (depth, mist) 只存储一份数据，
+# 以 expand 视图的形式广播为 3 个通道，而不是复制三份。
+PRECISIONS = {"float32": np.float32, "float16": np.float16}
+
+def allocate_pass_buffer(height, width, components, precision="float32"):
+    """为一个输出通道分配 (1, H, W, C) 的连续缓冲区。单分量通道只分配 1 个通道。"""
+    channels = 1 if components == 1 else 3
+    return np.empty((1, height, width, channels), dtype=PRECISIONS.get(precision, np.float32))
+
+def pass_buffer_to_tensor(buffer, clip=True):
+    """（可选地）原地裁剪缓冲区，并将其零拷贝地包装为 (1, H, W, 3) 张量。"""
+    if clip:
+        np.clip(buffer, 0, 1, out=buffer)
+    tensor = torch.from_numpy(buffer)
+    if tensor.shape[-1] == 1:
+        tensor = tensor.expand(-1, -1, -1, 3)
+    return tensor
+
+# --- 预览区域 (降采样 / 裁剪) ---
+# roi 为 None 或字典 {"scale": 步长, "crop": (x, y, w, h)}，w/h 为 0 表示到图像边缘。
+# 交互式预览时只读取裁剪范围内的扫描线，并在转换时按步长抽取像素。
+
+def make_roi(scale=1, crop_x=0, crop_y=0, crop_width=0, crop_height=0):
+    """根据节点选项构建 roi；全分辨率且不裁剪时返回 None。"""
+    scale = max(1, int(scale))
+    crop = (max(0, int(crop_x)), max(0, int(crop_y)), max(0, int(crop_width)), max(0, int(crop_height)))
+    if scale == 1 and crop == (0, 0, 0, 0):
+        return None
+    return {"scale": scale, "crop": crop}
+
+def roi_key(roi):
+    """roi 的可哈希表示，用于缓存键。"""
+    return None if roi is None else (roi["scale"],) + tuple(roi["crop"])
+
+def resolve_region(width, height, roi=None):
+    """将 roi 应用到 width x height 的图像，返回 (x0, y0, x1, y1, step)，右/下边界不含。"""
+    if roi is None:
+        return 0, 0, width, height, 1
+    cx, cy, cw, ch = roi["crop"]
+    x0, y0 = min(cx, width - 1), min(cy, height - 1)
+    x1 = width if cw <= 0 else min(width, x0 + cw)
+    y1 = height if ch <= 0 else min(height, y0 + ch)
+    return x0, y0, x1, y1, roi["scale"]
+
+def region_shape(region):
+    """返回区域降采样后的 (高, 宽)。"""
+    x0, y0, x1, y1, step = region
+    return -(-(y1 - y0) // step), -(-(x1 - x0) // step)
+
+def pil_to_tensor(image_pil, precision="float32", roi=None):
     """将 PIL.Image 对象转换为 ComfyUI 所需的 PyTorch 张量格式。"""
-    if image_pil.mode == 'RGBA':
+    if image_pil.mode not in ('RGB', 'RGBA', 'L'):
         image_pil = image_pil.convert('RGB')
-    image_np = np.array(image_pil).astype(np.float32) / 255.0
-    # 添加批处理维度
-    tensor = torch.from_numpy(image_np)[None,]
-    return tensor
+    # np.asarray 得到 uint8 数据，归一化时直接写入预分配的浮点缓冲区（唯一一次完整分配）
+    image_np = np.asarray(image_pil, dtype=np.uint8)
+    if image_np.ndim == 2:
+        image_np = image_np[..., None]
+    # RGBA 直接丢弃 alpha 通道；裁剪和降采样同样只是视图，不复制
+    x0, y0, x1, y1, step = resolve_region(image_np.shape[1], image_np.shape[0], roi)
+    image_np = image_np[y0:y1:step, x0:x1:step, :3]
+    height, width, components = image_np.shape
+    buffer = allocate_pass_buffer(height, width, components, precision)
+    np.divide(image_np, buffer.dtype.type(255), out=buffer[0])
+    return pass_buffer_to_tensor(buffer, clip=False)
 
-def handle_standard_image(file_path):
-    """从文件路径加载标准图像 (PNG, JPG) 并转换为张量。"""
-    if not os.path.exists(file_path):
-        print(f"[BlenderBridge-DataHub] 警告: 在 {file_path} 找不到文件")
+def handle_standard_image(file_info, precision="float32", roi=None):
+    """从内存缓冲区或文件路径加载标准图像 (PNG, JPG) 并转换为张量。"""
+    source = open_payload(file_info)
+    if isinstance(source, str) and not os.path.exists(source):
+        print(f"[BlenderBridge-DataHub] 警告: 在 {source} 找不到文件")
         return None
     try:
-        img_pil = Image.open(file_path)
-        return pil_to_tensor(img_pil)
+        img_pil = Image.open(source)
+        return pil_to_tensor(img_pil, precision, roi)
     except Exception as e:
-        print(f"[BlenderBridge-DataHub] 加载标准图像 {file_path} 时出错: {e}")
-        return None
-
-def get_crypto_manifest_and_prefix(header):
-    """从 EXR 标头动态查找 Cryptomatte 清单和层前缀。"""
-    for key, value in header.items():
-        if key.endswith('.manifest'):
-            prefix = key[:-len('manifest')]
-            manifest = json.loads(value)
-            return manifest, prefix
-    return None, None
-
-def hex_to_float(hex_str):
-    """将十六进制哈希字符串转换为浮点 ID。"""
-    return struct.unpack('!f', bytes.fromhex(hex_str))[0]
-
-def extract_cryptomatte_mask(exr_file, header, width, height, object_name):
-    """从已打开的 EXR 文件中提取 Cryptomatte 遮罩。"""
-    manifest, prefix = get_crypto_manifest_and_prefix(header)
-    if not manifest:
-        print("[BlenderBridge-DataHub] 错误: 在 EXR 标头中找不到 Cryptomatte 清单。")
+        print(f"[BlenderBridge-DataHub] 加载标准图像 {describe_payload(file_info)} 时出错: {e}")
         return None
 
-    target_id_hash = manifest.get(object_name)
-    if not target_id_hash:
-        print(f"[BlenderBridge-DataHub] 错误: 在 Cryptomatte 清单中找不到对象 '{object_name}'。可用对象: {list(manifest.keys())}")
+def get_connected_outputs(prompt, unique_id, output_names):
+    """
+    从 ComfyUI 的 API 格式 prompt 中找出本节点有哪些输出端口被下游节点连接。
+    返回输出名称的集合；如果无法确定（例如 prompt 为空或不包含本节点），返回 None 表示"全部需要"。
+    """
+    if not isinstance(prompt, dict) or unique_id is None:
         return None
-    
-    target_id_float = hex_to_float(target_id_hash)
-    
-    id_channel_name = f'{prefix}00.R'
-    if id_channel_name not in header['channels']:
-        print(f"[BlenderBridge-DataHub] 错误: 在 EXR 文件中找不到 Cryptomatte 通道 '{id_channel_name}'。")
+    node_id = str(unique_id)
+    if node_id not in prompt:
         return None
+    connected = set()
+    for node in prompt.values():
+        inputs = node.get("inputs", {}) if isinstance(node, dict) else {}
+        for value in inputs.values():
+            # 连接在 API 格式中表示为 [源节点 id, 输出索引]
+            if isinstance(value, list) and len(value) == 2 and str(value[0]) == node_id:
+                index = value[1]
+                if isinstance(index, int) and 0 <= index < len(output_names):
+                    connected.add(output_names[index])
+    return connected
 
-    id_r_channel_str = exr_file.channel(id_channel_name, Imath.PixelType(Imath.PixelType.FLOAT))
-    ids_r = np.frombuffer(id_r_channel_str, dtype=np.float32).reshape((height, width))
-    
-    mask_np = np.isclose(ids_r, target_id_float).astype(np.float32)
-    
-    mask_tensor = torch.from_numpy(mask_np).unsqueeze(0)
-    print(f"[BlenderBridge-DataHub] 已为 '{object_name}' 成功创建 Cryptomatte 遮罩。")
-    return mask_tensor
+# 节点上 decode_workers 为 0（自动）时使用的线程数；环境变量设为 0 表示 CPU 核心数。
+# 默认为 1：OpenEXR 3.x 的绑定在 InputFile.channels() 期间持有 GIL，而读取占解码的大部分时间，
+# 多线程只能并行之后的 NumPy 转换（以及原始通道的 lz4/zstd 解压），却要为每个线程重新打开文件
+DEFAULT_DECODE_WORKERS = int(os.environ.get("BLENDER_BRIDGE_DECODE_WORKERS", "1"))
+
+# 各 EXR 压缩方式每个数据块包含的扫描线数。按块边界划分扫描线区间，
+# 可以避免相邻区间重复解压同一个数据块。
+EXR_LINES_PER_BLOCK = {
+    "NO_COMPRESSION": 1, "RLE_COMPRESSION": 1, "ZIPS_COMPRESSION": 1,
+    "ZIP_COMPRESSION": 16, "PXR24_COMPRESSION": 16, "PIZ_COMPRESSION": 32,
+    "B44_COMPRESSION": 32, "B44A_COMPRESSION": 32, "DWAA_COMPRESSION": 32,
+    "DWAB_COMPRESSION": 256,
+}
+
+COMPONENT_MAP = {
+    'image': ['.R', '.G', '.B'], 'depth': ['.Z'], 'mist': ['.Z'],
+    'normal': ['.X', '.Y', '.Z'], 'position': ['.X', '.Y', '.Z'], 'vector': ['.X', '.Y', '.Z', '.W'],
+    'diffuse_direct': ['.R', '.G', '.B'], 'diffuse_color': ['.R', '.G', '.B'],
+    'glossy_direct': ['.R', '.G', '.B'], 'glossy_color': ['.R', '.G', '.B'],
+    'volume_direct': ['.R', '.G', '.B'], 'emission': ['.R', '.G', '.B'],
+    'environment': ['.R', '.G', '.B'], 'shadow': ['.R', '.G', '.B'], 'ambient_occlusion': ['.R', '.G', '.B']
+}
+
+def resolve_decode_workers(requested):
+    """将用户请求的工作线程数 (0 = 自动，即 DEFAULT_DECODE_WORKERS) 转换为实际使用的线程数。"""
+    workers = requested if requested and requested > 0 else DEFAULT_DECODE_WORKERS
+    if workers <= 0:
+        workers = os.cpu_count() or 1
+    return max(1, int(workers))
+
+def plan_scanline_bands(y_min, y_max, workers, lines_per_block, origin=None):
+    """
+    将 [y_min, y_max] 划分为最多约 workers 个扫描线区间。
+    区间边界对齐到从 origin（数据窗口的第一行）开始的数据块网格。
+    """
+    height = y_max - y_min + 1
+    if workers <= 1:
+        return [(y_min, y_max)]
+    origin = y_min if origin is None else origin
+    band = -(-height // workers)
+    band = max(lines_per_block, -(-band // lines_per_block) * lines_per_block)
+    # 第一个位于 y_min 之后的网格边界
+    grid = origin + ((y_min - origin) // lines_per_block + 1) * lines_per_block
+    starts = [y_min] + list(range(grid + band - lines_per_block, y_max + 1, band))
+    starts = sorted(set(starts))
+    return [(start, (starts[i + 1] - 1) if i + 1 < len(starts) else y_max) for i, start in enumerate(starts)]
 
-def process_multilayer_exr(file_path, metadata):
-    """根据Blender插件提供的'基础通道名'，并结合节点自身的'组件'知识，智能地提取通道。"""
+def process_multilayer_exr(file_info, metadata, wanted=None, workers=1, precision="float32", roi=None, timings=None):
+    """
+    根据Blender插件提供的'基础通道名'，并结合节点自身的'组件'知识，智能地提取通道。
+    如果提供了 wanted（输出名称集合），则只解码其中的通道。
+    workers > 1 时，图像按扫描线区间划分，由线程池并行读取和转换；
+    每个区间写入输出数组中互不重叠的行，因此结果与串行解码完全一致。
+    提供 roi 时，只读取裁剪范围内的扫描线，并按步长降采样。
+    提供 timings 字典时，累加各区间读取 (exr_read) 和转换 (tensor_convert) 的耗时。
+    """
     if not OPENEXR_SUPPORT:
         return {}
 
@@ -91,31 +247,27 @@ def process_multilayer_exr(file_path, metadata):
         print("[BlenderBridge-DataHub] 警告: multilayer_exr 类型缺少 'channel_map' 元数据。无法提取通道。")
         return {}
 
-    outputs = {}
     try:
-        exr_file = OpenEXR.InputFile(file_path)
+        exr_file = OpenEXR.InputFile(open_payload(file_info))
         header = exr_file.header()
         dw = header['dataWindow']
         width, height = (dw.max.x - dw.min.x + 1, dw.max.y - dw.min.y + 1)
         all_channels_in_file = list(header['channels'].keys())
         
         print(f"[BlenderBridge-DataHub] 使用 Blender 提供的 Channel Map: {channel_map}")
-        
-        COMPONENT_MAP = {
-            'image': ['.R', '.G', '.B'], 'depth': ['.Z'], 'mist': ['.Z'],
-            'normal': ['.X', '.Y', '.Z'], 'position': ['.X', '.Y', '.Z'], 'vector': ['.X', '.Y', '.Z', '.W'],
-            'diffuse_direct': ['.R', '.G', '.B'], 'diffuse_color': ['.R', '.G', '.B'],
-            'glossy_direct': ['.R', '.G', '.B'], 'glossy_color': ['.R', '.G', '.B'],
-            'volume_direct': ['.R', '.G', '.B'], 'emission': ['.R', '.G', '.B'],
-            'environment': ['.R', '.G', '.B'], 'shadow': ['.R', '.G', '.B'], 'ambient_occlusion': ['.R', '.G', '.B']
-        }
 
+        # 复制一份，避免修改管道中的元数据
+        channel_map = dict(channel_map)
         if 'combined' in channel_map and 'image' not in channel_map:
             channel_map['image'] = channel_map.pop('combined')
 
+        # 1. 确定要解码的通道及其组件
+        tasks = []
         for out_name, base_name in channel_map.items():
             if out_name not in COMPONENT_MAP:
                 continue
+            if wanted is not None and out_name not in wanted:
+                continue
             
             components = COMPONENT_MAP[out_name]
             full_channels_to_find = [f"{base_name}{c}" for c in components]
@@ -125,20 +277,73 @@ def process_multilayer_exr(file_path, metadata):
                 full_channels_to_find = full_channels_to_find[:3]
 
             if all(c in all_channels_in_file for c in full_channels_to_find):
-                if len(full_channels_to_find) == 1:
-                    ch_str = exr_file.channel(full_channels_to_find[0])
-                    ch_np = np.frombuffer(ch_str, dtype=np.float32)
-                    img_np = np.clip(np.dstack((ch_np, ch_np, ch_np)), 0, 1)
-                    outputs[out_name] = torch.from_numpy(img_np).view(height, width, 3)[None,]
-                else: # RGB or VEC
-                    ch_strs = [exr_file.channel(c) for c in full_channels_to_find]
-                    ch_nps = [np.frombuffer(s, dtype=np.float32) for s in ch_strs]
-                    img_np = np.clip(np.dstack(ch_nps), 0, 1)
-                    outputs[out_name] = torch.from_numpy(img_np).view(height, width, 3)[None,]
+                tasks.append((out_name, full_channels_to_find))
             else:
                 # This warning is now very specific and useful
                 print(f"[BlenderBridge-DataHub] 警告: 未能为 '{out_name}' 找到所有必需的组件。尝试寻找: {full_channels_to_find}")
 
+        if not tasks:
+            return {}
+
+        # 2. 为每个输出预分配缓冲区，各区间直接写入其中
+        x0, y0, x1, y1, step = region = resolve_region(width, height, roi)
+        out_height, out_width = region_shape(region)
+        if roi is not None:
+            print(f"[BlenderBridge-DataHub] 预览模式: 区域 ({x0}, {y0})-({x1}, {y1})，步长 {step}，输出 {out_width}x{out_height}。")
+        needed_channels = list(dict.fromkeys(c for _, chans in tasks for c in chans))
+        arrays = {out_name: allocate_pass_buffer(out_height, out_width, len(chans), precision) for out_name, chans in tasks}
+        first_line = dw.min.y + y0
+        pixel_type = Imath.PixelType(Imath.PixelType.FLOAT)
+        local = threading.local()
+
+        timings_lock = threading.Lock()
+
+        def decode_band(band):
+            y1, y2 = band
+            # OpenEXR 的 InputFile 不是线程安全的，每个线程使用自己的实例
+            band_file = exr_file if workers <= 1 else getattr(local, "exr_file", None)
+            if band_file is None:
+                band_file = local.exr_file = OpenEXR.InputFile(open_payload(file_info))
+            # 一次调用读取全部所需通道，数据块只需解压一次
+            started = time.perf_counter()
+            raw = band_file.channels(needed_channels, pixel_type, y1, y2)
+            read_done = time.perf_counter()
+            # 本区间中第一个落在降采样网格上的行（相对于裁剪区域的第一行）
+            relative = y1 - first_line
+            first = -(-relative // step) * step
+            offset = first - relative
+            if offset > y2 - y1:
+                return
+            planes = {
+                name: np.frombuffer(buf, dtype=np.float32).reshape(-1, width)[offset::step, x0:x1:step]
+                for name, buf in zip(needed_channels, raw)
+            }
+            count = next(iter(planes.values())).shape[0]
+            rows = slice(first // step, first // step + count)
+            for out_name, chans in tasks:
+                dst = arrays[out_name][0, rows]
+                for i, c in enumerate(chans):
+                    dst[..., i] = planes[c]
+                np.clip(dst, 0, 1, out=dst)
+            if timings is not None:
+                with timings_lock:
+                    timings["exr_read"] = timings.get("exr_read", 0.0) + (read_done - started)
+                    timings["tensor_convert"] = timings.get("tensor_convert", 0.0) + (time.perf_counter() - read_done)
+
+        compression = str(header.get('compression', 'ZIP_COMPRESSION'))
+        bands = plan_scanline_bands(first_line, dw.min.y + y1 - 1, workers, EXR_LINES_PER_BLOCK.get(compression, 32), origin=dw.min.y)
+        if len(bands) <= 1:
+            for band in bands:
+                decode_band(band)
+        else:
+            print(f"[BlenderBridge-DataHub] 使用 {min(workers, len(bands))} 个线程并行解码 {len(bands)} 个扫描线区间。")
+            with ThreadPoolExecutor(max_workers=min(workers, len(bands))) as pool:
+                # list() 会传播工作线程中的异常
+                list(pool.map(decode_band, bands))
+
+        # 各区间已完成裁剪，这里只需零拷贝地包装为张量
+        outputs = {out_name: pass_buffer_to_tensor(arrays[out_name], clip=False) for out_name, _ in tasks}
+
         extracted = list(outputs.keys())
         if extracted:
             print(f"[BlenderBridge-DataHub] 成功提取通道: {extracted}")
@@ -146,14 +351,293 @@ def process_multilayer_exr(file_path, metadata):
         return outputs
         
     except Exception as e:
-        print(f"[BlenderBridge-DataHub] 处理 EXR 文件 '{file_path}' 时出错: {e}")
+        print(f"[BlenderBridge-DataHub] 处理 EXR 文件 '{describe_payload(file_info)}' 时出错: {e}")
         return {}
 
+def decode_raw_pass(pass_info, precision="float32", roi=None):
+    """将一个原始通道（可能经过 lz4/zstd 压缩）转换为 (1, H, W, 3) 张量。"""
+    data = decompress(pass_info["data"], pass_info.get("compression", "none"))
+    shape = pass_info["shape"]
+    array = np.frombuffer(data, dtype=np.dtype(pass_info.get("dtype", "float32"))).reshape(shape)
+    if array.ndim == 2:
+        array = array[..., None]
+    if pass_info.get("flip_y"):
+        # Blender 的像素缓冲区从底部开始，翻转只是一个视图
+        array = array[::-1]
+    x0, y0, x1, y1, step = resolve_region(array.shape[1], array.shape[0], roi)
+    array = array[y0:y1:step, x0:x1:step]
+    height, width, components = array.shape
+    buffer = allocate_pass_buffer(height, width, 1 if components == 1 else 3, precision)
+    fill_pass_buffer(array, buffer[0])
+    return pass_buffer_to_tensor(buffer)
+
+def fill_pass_buffer(array, dst):
+    """将 (h, w, C) 的原始像素写入 (h, w, c) 的目标视图：uint8 缩放到 [0, 1]，多余的分量丢弃。"""
+    used = min(array.shape[-1], dst.shape[-1])
+    if array.dtype == np.uint8:
+        np.divide(array[..., :used], dst.dtype.type(255), out=dst[..., :used])
+    else:
+        dst[..., :used] = array[..., :used]
+    if used < dst.shape[-1]:
+        # 例如 2 分量的向量通道，缺失的分量补 0
+        dst[..., used:] = 0
+
+def raw_pass_cache_key(digest, pass_info, compression, precision, roi):
+    """单个原始通道张量的缓存键。"""
+    return make_cache_key(
+        digest, None, "raw_pass", pass_info.get("dtype"), tuple(pass_info["shape"]),
+        compression, bool(pass_info.get("flip_y")), precision, roi_key(roi),
+    )
+
+def patch_pass_tensor(base, pass_info):
+    """
+    在基准张量的副本上只转换脏矩形（脏矩形增量见 frame_delta.py），不必重新转换整个通道。
+    base 为已缓存的张量，不会被修改。
+    """
+    if base.stride(-1) == 0:
+        # 单分量通道是广播为 3 通道的视图，只复制其中一个分量
+        single = base[..., :1].clone()
+        tensor, target = single.expand_as(base), single.numpy()
+    else:
+        tensor = base.clone()
+        target = tensor.numpy()
+    height = target.shape[1]
+    for rect in pass_info["patch"]["rects"]:
+        x, y, w, h, data = rect["x"], rect["y"], rect["width"], rect["height"], rect["data"]
+        if pass_info.get("flip_y"):
+            # 矩形坐标以存储顺序（底部为第 0 行）给出
+            rows, data = slice(height - y - h, height - y), data[::-1]
+        else:
+            rows = slice(y, y + h)
+        dst = target[0, rows, x:x + w]
+        fill_pass_buffer(data, dst)
+        np.clip(dst, 0.0, 1.0, out=dst)
+    return tensor
+
+def decode_raw_pass_cached(pass_info, precision="float32", roi=None):
+    """
+    带缓存的 decode_raw_pass。缓存按通道的哈希进行，因此增量帧中没有变化的通道直接命中；
+    变化的通道在基准张量已缓存时只转换脏矩形。缓存被禁用时 Receiver 不计算哈希，直接转换。
+    """
+    if pass_info.get("digest") is None:
+        return decode_raw_pass(pass_info, precision, roi)
+    key = raw_pass_cache_key(pass_info["digest"], pass_info, pass_info.get("compression", "none"), precision, roi)
+    cached, missing = FRAME_CACHE.lookup(key)
+    if missing is not None and not missing:
+        return cached["tensor"]
+
+    tensor = None
+    patch = pass_info.get("patch")
+    if patch is not None and roi is None:
+        base_key = raw_pass_cache_key(patch["base_digest"], pass_info, patch["base_compression"], precision, None)
+        base, missing = FRAME_CACHE.lookup(base_key)
+        if missing is not None and not missing:
+            tensor = patch_pass_tensor(base["tensor"], pass_info)
+    if tensor is None:
+        tensor = decode_raw_pass(pass_info, precision, roi)
+    FRAME_CACHE.store(key, {"tensor": tensor}, None)
+    return tensor
+
+def process_raw_passes(file_info, wanted=None, workers=1, precision="float32", roi=None):
+    """
+    将原始通道格式的帧转换为张量，没有任何编解码工作（除了可选的 lz4/zstd 解压）。
+    通道名称与 DataHub 的输出名称一致（'combined' 视为 'image'）。
+    """
+    tasks = []
+    for pass_info in file_info.get("passes", []):
+        out_name = 'image' if pass_info["name"] == 'combined' else pass_info["name"]
+        if wanted is not None and out_name not in wanted:
+            continue
+        tasks.append((out_name, pass_info))
+
+    def decode(task):
+        out_name, pass_info = task
+        try:
+            return out_name, decode_raw_pass_cached(pass_info, precision, roi)
+        except Exception as e:
+            print(f"[BlenderBridge-DataHub] 转换原始通道 '{out_name}' 时出错: {e}")
+            return out_name, None
+
+    if workers > 1 and len(tasks) > 1:
+        # 解压和数组复制都会释放 GIL，可以并行
+        with ThreadPoolExecutor(max_workers=min(workers, len(tasks))) as pool:
+            results = list(pool.map(decode, tasks))
+    else:
+        results = [decode(task) for task in tasks]
+
+    outputs = {name: tensor for name, tensor in results if tensor is not None}
+    if outputs:
+        print(f"[BlenderBridge-DataHub] 成功转换原始通道: {list(outputs.keys())}")
+    return outputs
+
+def payload_digest(file_info):
+    """返回数据的内容哈希。优先使用 Receiver 已计算好的哈希。"""
+    content_hash = file_info.get("content_hash")
+    if content_hash:
+        return content_hash
+    if file_info.get("data") is not None:
+        content_hash = compute_content_hash(file_info["data"])
+        file_info["content_hash"] = content_hash
+        return content_hash
+    path = file_info.get("path")
+    if path and os.path.exists(path):
+        # 磁盘文件: 使用路径、大小和修改时间作为廉价的标识
+        st = os.stat(path)
+        return f"file:{path}:{st.st_size}:{st.st_mtime_ns}"
+    return None
+
+def decode_frame(file_info, metadata, wanted=None, workers=1, precision="float32", roi=None, timings=None):
+    """根据 render_type 将一帧数据解码为 {输出名称: 张量} 字典。"""
+    file_path = file_info.get("path")
+    has_payload = file_info.get("data") is not None or bool(file_path)
+    file_name = file_path or file_info.get("original_name", "")
+    render_type = file_info.get("type")
+
+    processed_outputs = {}
+    if render_type == 'raw_passes':
+        print(f"[BlenderBridge-DataHub] 检测到原始通道数据，直接转换为张量。")
+        processed_outputs = process_raw_passes(file_info, wanted, workers, precision, roi)
+
+    elif render_type == 'multilayer_exr':
+        if has_payload and file_name.lower().endswith('.exr'):
+            print(f"[BlenderBridge-DataHub] 检测到多层 EXR，使用元数据 channel_map 进行处理。")
+            processed_outputs = process_multilayer_exr(file_info, metadata, wanted, workers, precision, roi, timings)
+        else:
+             print(f"[BlenderBridge-DataHub] 错误: render_type 为 'multilayer_exr' 但文件不是 .exr 或路径无效。")
+    
+    elif render_type == 'standard':
+        print(f"[BlenderBridge-DataHub] 检测到标准图像，仅加载主图像。")
+        if has_payload:
+            processed_outputs['image'] = handle_standard_image(file_info, precision, roi)
+    
+    else:
+        print(f"[BlenderBridge-DataHub] 未知的 render_type: '{render_type}' 或无文件。将尝试后备加载。")
+        if has_payload:
+            processed_outputs['image'] = handle_standard_image(file_info, precision, roi)
+
+    return {name: t for name, t in processed_outputs.items() if t is not None}
+
+def decode_frame_cached(file_info, metadata, wanted=None, workers=1, precision="float32", roi=None, timings=None):
+    """带缓存的 decode_frame：相同数据和 channel_map 的重复帧直接从缓存返回。"""
+    if file_info.get("type") == "raw_passes":
+        # 原始通道按单个通道缓存（见 decode_raw_pass_cached），不再按整帧缓存
+        return decode_frame(file_info, metadata, wanted, workers, precision, roi, timings)
+    if not FRAME_CACHE.enabled:
+        # 缓存被禁用时不需要内容哈希
+        return decode_frame(file_info, metadata, wanted, workers, precision, roi, timings)
+    content_hash = payload_digest(file_info)
+    if content_hash is None:
+        return decode_frame(file_info, metadata, wanted, workers, precision, roi, timings)
+
+    key = make_cache_key(content_hash, metadata, file_info.get("type"), precision, roi_key(roi))
+    cached, missing = FRAME_CACHE.lookup(key, wanted)
+    if missing is not None and not missing:
+        stats = FRAME_CACHE.stats()
+        print(f"[BlenderBridge-DataHub] 缓存命中 ({content_hash[:12]})，跳过解码。命中/未命中: {stats['hits']}/{stats['misses']}")
+        return cached
+
+    decoded = decode_frame(file_info, metadata, missing, workers, precision, roi, timings)
+    if decoded:
+        FRAME_CACHE.store(key, decoded, missing)
+    cached.update(decoded)
+    return cached
+
+# 所有缺失通道共享的单像素黑色缓冲区（每种精度一个）
+_PLACEHOLDER_PIXELS = {
+    name: torch.zeros((1, 1, 1, 3), dtype=getattr(torch, name), device="cpu") for name in PRECISIONS
+}
+
+def get_placeholder_image(h, w, precision="float32", batch=1):
+    """
+    返回一个 batch x h x w 的黑色占位图像。它是共享零缓冲区的 expand 视图，不分配新的内存，
+    因此缺失通道再多也不会增加内存占用。该张量应视为只读（原地修改会报错）。
+    """
+    return _PLACEHOLDER_PIXELS.get(precision, _PLACEHOLDER_PIXELS["float32"]).expand(batch, h, w, 3)
+
+def pipe_frames(bridge_pipe):
+    """
+    返回管道中每帧的 (文件信息, 元数据, 追踪记录) 列表，按帧顺序排列。
+    没有 "frames" 字段的管道（单帧）使用顶层的元数据和追踪记录。
+    """
+    files = bridge_pipe.get("files", [])
+    frames = bridge_pipe.get("frames") or [{"metadata": bridge_pipe.get("metadata", {}), "trace": bridge_pipe.get("trace")}]
+    metadata = bridge_pipe.get("metadata", {})
+    return [
+        (file_info, frames[i].get("metadata", metadata), frames[i].get("trace")) if i < len(frames) else (file_info, metadata, None)
+        for i, file_info in enumerate(files)
+    ]
+
+class BatchAssembler:
+    """
+    将每帧的 {输出名称: (1, H, W, C)} 写入预分配的 {输出名称: (N, H, W, C)}。
+    每个输出在第一次出现时分配一次批次缓冲区，之后每帧解码完成后立即复制到自己的行，
+    不再保留所有帧的张量再 torch.cat（那样峰值内存是批次的两倍）。
+    单分量通道（expand 视图）只存储 1 个通道，结果同样以 expand 视图广播为 3 通道；
+    某些帧缺少的通道在 finish() 中用 0 填充，所有帧都缺少的通道不分配内存（由调用方输出共享的占位图像）。
+    """
+
+    def __init__(self, count):
+        self.count = count
+        self.lock = threading.Lock()
+        # 输出名称 -> {"buffer": (N, H, W, c), "shape": (H, W, C), "rows": 已写入的行}
+        self.entries = {}
+
+    def place(self, index, outputs):
+        """将第 index 帧的输出复制到批次缓冲区的对应行。可从多个解码线程调用。"""
+        for name, tensor in outputs.items():
+            shape = tuple(tensor.shape[1:])
+            single = tensor.stride(-1) == 0
+            with self.lock:
+                entry = self.entries.get(name)
+                if entry is None:
+                    channels = 1 if single else shape[-1]
+                    entry = self.entries[name] = {
+                        "buffer": torch.empty((self.count,) + shape[:-1] + (channels,), dtype=tensor.dtype),
+                        "shape": shape, "rows": set(),
+                    }
+                elif entry["shape"] != shape:
+                    raise ValueError(f"批次中各帧的输出 '{name}' 尺寸不一致: {entry['shape']} 与 {shape}")
+                elif entry["buffer"].shape[-1] == 1 and not single:
+                    # 之前的帧都是单分量，这一帧不是：展开为完整的通道
+                    entry["buffer"] = entry["buffer"].expand(-1, -1, -1, shape[-1]).clone()
+                buffer = entry["buffer"]
+                # 复制在锁内进行，避免与上面的展开同时发生；与解码相比复制很快
+                buffer[index].copy_(tensor[0, ..., :buffer.shape[-1]])
+                entry["rows"].add(index)
+
+    def finish(self):
+        """返回 {输出名称: (N, H, W, C)}，缺少该通道的帧对应的行填充为 0。"""
+        stacked = {}
+        for name, entry in self.entries.items():
+            buffer = entry["buffer"]
+            for index in range(self.count):
+                if index not in entry["rows"]:
+                    buffer[index].zero_()
+            if buffer.shape[-1] != entry["shape"][-1]:
+                buffer = buffer.expand(-1, -1, -1, entry["shape"][-1])
+            stacked[name] = buffer
+        return stacked
+
 class BlenderBridge_DataHub:
     @classmethod
     def INPUT_TYPES(cls):
         return {
             "required": { "bridge_pipe": ("BRIDGE_PIPE",) },
+            # decode_workers: 解码线程数，0 表示自动 (BLENDER_BRIDGE_DECODE_WORKERS，默认 1，即串行)；
+            # EXR 读取持有 GIL，更多线程只加速 NumPy 转换和原始通道的解压
+            # precision: 输出张量的精度，float16 可将内存占用减半
+            # preview_scale / crop_*: 交互式预览的降采样步长和裁剪矩形（宽高为 0 表示到图像边缘），
+            # 默认值即为全分辨率解码，用于最终渲染
+            "optional": {
+                "decode_workers": ("INT", {"default": 0, "min": 0, "max": 128}),
+                "precision": (list(PRECISIONS.keys()), {"default": "float32"}),
+                "preview_scale": ("INT", {"default": 1, "min": 1, "max": 16}),
+                "crop_x": ("INT", {"default": 0, "min": 0, "max": 65536}),
+                "crop_y": ("INT", {"default": 0, "min": 0, "max": 65536}),
+                "crop_width": ("INT", {"default": 0, "min": 0, "max": 65536}),
+                "crop_height": ("INT", {"default": 0, "min": 0, "max": 65536}),
+            },
+            "hidden": { "prompt": "PROMPT", "unique_id": "UNIQUE_ID" },
         }
 
     RETURN_TYPES = (
@@ -168,52 +652,91 @@ class BlenderBridge_DataHub:
     FUNCTION = "execute"
     CATEGORY = "Blender Bridge"
 
-    def execute(self, bridge_pipe):
-        print(f"[BlenderBridge-DataHub] 开始处理管道: {bridge_pipe}")
+    @classmethod
+    def IS_CHANGED(cls, **kwargs):
+        # 输出端口的连接情况会影响需要解码的通道，但 ComfyUI 调用 IS_CHANGED 时不提供 prompt，
+        # 无法检测连接变化，因此总是重新执行。重复执行的代价很小：FRAME_CACHE 记录了已尝试的通道，
+        # 只有新连接的输出才会真正解码
+        return float("NaN")
+
+    def execute(self, bridge_pipe, decode_workers=0, precision="float32", preview_scale=1,
+                crop_x=0, crop_y=0, crop_width=0, crop_height=0, prompt=None, unique_id=None):
+        # 管道中可能包含整帧的缓冲区和脏矩形数组，只打印摘要
+        print(f"[BlenderBridge-DataHub] 开始处理管道: 会话 '{bridge_pipe.get('session_id')}'，第 {bridge_pipe.get('sequence')} 帧，"
+              f"{[describe_payload(f) for f in bridge_pipe.get('files', [])]}")
+
+        # 只解码下游实际连接的输出，未连接的通道将输出黑色占位图像
+        wanted = get_connected_outputs(prompt, unique_id, self.RETURN_NAMES)
+        if wanted is not None:
+            print(f"[BlenderBridge-DataHub] 下游已连接的输出: {sorted(wanted)}")
         
-        files = bridge_pipe.get("files", [])
-        metadata = bridge_pipe.get("metadata", {})
+        frames = pipe_frames(bridge_pipe)
         
         outputs = {name: None for name in self.RETURN_NAMES}
         
-        main_file = files[0] if files else {}
-        file_path = main_file.get("path")
+        main_file = frames[0][0] if frames else {}
         render_type = main_file.get("type")
 
-        processed_outputs = {}
-        if render_type == 'multilayer_exr':
-            if file_path and file_path.lower().endswith('.exr'):
-                print(f"[BlenderBridge-DataHub] 检测到多层 EXR，使用元数据 channel_map 进行处理。")
-                processed_outputs = process_multilayer_exr(file_path, metadata)
-            else:
-                 print(f"[BlenderBridge-DataHub] 错误: render_type 为 'multilayer_exr' 但文件不是 .exr 或路径无效。")
-        
-        elif render_type == 'standard':
-            print(f"[BlenderBridge-DataHub] 检测到标准图像，仅加载主图像。")
-            if file_path:
-                processed_outputs['image'] = handle_standard_image(file_path)
-        
-        else:
-            print(f"[BlenderBridge-DataHub] 未知的 render_type: '{render_type}' 或无文件。将尝试后备加载。")
-            if file_path:
-                processed_outputs['image'] = handle_standard_image(file_path)
+        # 显式传入全部输出名称，使缓存能够只补充解码尚未缓存的通道
+        session_id = bridge_pipe.get("session_id")
+        wanted_names = wanted if wanted is not None else set(self.RETURN_NAMES)
+        roi = make_roi(preview_scale, crop_x, crop_y, crop_width, crop_height)
+        workers = resolve_decode_workers(decode_workers)
+        # 批处理时各帧并行解码，线程数在帧之间平均分配
+        frame_threads = max(1, min(len(frames), workers))
+        frame_workers = max(1, workers // frame_threads)
+
+        def decode(frame):
+            file_info, frame_metadata, trace = frame
+            timings = {}
+            with STATS.timed(session_id, "decode", file_info.get("size", 0), trace):
+                decoded = decode_frame_cached(
+                    file_info, frame_metadata, wanted_names,
+                    workers=frame_workers, precision=precision, roi=roi, timings=timings,
+                )
+            # EXR 读取和张量转换的耗时为各区间之和
+            for stage, seconds in timings.items():
+                STATS.record(session_id, stage, seconds, trace=trace)
+            return decoded
+
+        if len(frames) == 1:
+            # 单帧直接使用解码结果（保留缓存中的张量和 expand 视图，不做任何复制）
+            outputs.update(decode(frames[0]))
+        elif frames:
+            # 每帧解码完成后立即写入批次缓冲区中自己的行，释放该帧的张量
+            assembler = BatchAssembler(len(frames))
 
-        outputs.update(processed_outputs)
+            def decode_into(index):
+                assembler.place(index, decode(frames[index]))
+
+            if frame_threads > 1:
+                with ThreadPoolExecutor(max_workers=frame_threads) as pool:
+                    # list() 会传播工作线程中的异常
+                    list(pool.map(decode_into, range(len(frames))))
+            else:
+                for index in range(len(frames)):
+                    decode_into(index)
+            outputs.update(assembler.finish())
+        batch = max(1, len(frames))
 
         h, w = 512, 512 # 如果没有任何图像，则为默认尺寸
-        if outputs.get('image') is not None:
-            h = outputs['image'].shape[1]
-            w = outputs['image'].shape[2]
+        # 优先使用主图像的尺寸；如果主图像未被解码，则使用任意已解码的通道
+        reference = outputs.get('image')
+        if reference is None:
+            reference = next((t for t in outputs.values() if t is not None), None)
+        if reference is not None:
+            h = reference.shape[1]
+            w = reference.shape[2]
 
         for i, name in enumerate(self.RETURN_NAMES):
             if outputs.get(name) is None:
-                # 仅当期望处理多层EXR时才打印警告
-                if render_type == 'multilayer_exr':
+                # 仅当期望处理多层EXR且该输出已连接时才打印警告
+                if render_type == 'multilayer_exr' and (wanted is None or name in wanted):
                     print(f"[BlenderBridge-DataHub] 警告: 未在 channel_map 中找到或提取通道 '{name}'。将输出一个 {h}x{w} 的黑色图像。")
                 
                 return_type = self.RETURN_TYPES[i]
                 if return_type == "IMAGE":
-                    outputs[name] = torch.zeros((1, h, w, 3), dtype=torch.float32, device="cpu")
+                    outputs[name] = get_placeholder_image(h, w, precision, batch)
         
-        print(f"[BlenderBridge-DataHub] 管道处理完成。")
+        print(f"[BlenderBridge-DataHub] 管道处理完成 ({batch} 帧)。")
         return tuple(outputs[name] for name in self.RETURN_NAMES) 
\ No newline at end of file
@@ -3,34 +3,80 @@
 import zmq
 import threading
 import msgspec
+import numpy as np
 import time
 import os
-import folder_paths
-import uuid
+from concurrent.futures import ThreadPoolExecutor
+from .frame_cache import compute_content_hash
+from .chunked_upload import UploadManager, UploadError
+from .encoding import RAW_DTYPES, compression_available
+from .frame_delta import RetainedFrames, DeltaError, apply_delta, combine_pass_digests
+from .frame_cache import FRAME_CACHE
+from .frame_store import TEMP_STORE, OUTPUT_STORE
+from .stats import STATS
+from .uploader import UPLOADER
+from .frame_queue import FrameQueue, QueueFullError, QUEUE_POLICIES, DEFAULT_QUEUE_POLICY, DEFAULT_QUEUE_SIZE, DEFAULT_BLOCK_TIMEOUT
+
+# --- 传输模式 ---
+# "memory": 接收到的数据以零拷贝的 zmq.Frame 缓冲区形式直接放入 bridge_pipe，DataHub 从内存解码。
+# "disk":   旧行为，将数据写入 ComfyUI 临时目录，DataHub 再从磁盘读取（作为后备）。
+# Blender 也可以在元数据中通过 "transport" 字段为单个请求覆盖此设置。
+TRANSPORT_MODES = ("memory", "disk")
+DEFAULT_TRANSPORT = os.environ.get("BLENDER_BRIDGE_TRANSPORT", "memory").lower()
+if DEFAULT_TRANSPORT not in TRANSPORT_MODES:
+    print(f"[BlenderBridge] 警告: 未知的传输模式 '{DEFAULT_TRANSPORT}'，将使用 'memory'。")
+    DEFAULT_TRANSPORT = "memory"
+
+# --- 服务器配置 ---
+SERVER_ADDRESS = os.environ.get("BLENDER_BRIDGE_ZMQ_ADDRESS", "tcp://127.0.0.1:5555")
+# 处理上传（哈希、磁盘写入、入队）的工作线程数。ping 等轻量请求始终由服务器线程直接回复。
+SERVER_WORKERS = int(os.environ.get("BLENDER_BRIDGE_SERVER_WORKERS", "8"))
+# 工作线程通过此 inproc 地址把回复交还给服务器线程（ZMQ 套接字不能跨线程共享）
+REPLY_ADDRESS = "inproc://blender-bridge-replies"
+# 工作线程处理请求时的上下文: defer_reply(reply) 用于在请求处理完之后（例如 "block" 策略下有空位时）发送回复
+REQUEST_CONTEXT = threading.local()
 
 # --- 全局状态 (交互模式) ---
-# 这个字典将为"交互模式"保存从 Blender 接收到的最新数据。
-# 它充当服务器线程和节点执行之间的共享空间。
-LATEST_DATA = {
+# 每个会话 (session_id) 有自己的有界帧队列，每帧带有序列号。
+# 它们充当服务器线程和节点执行之间的共享空间，Receiver 节点的 execute 方法会等待其会话的新帧。
+# 未提供 session_id 的 Blender 客户端使用 "default" 会话。
+DEFAULT_SESSION = "default"
+SESSIONS = {
     "lock": threading.Lock(),
-    "files": [],
-    "metadata": None,
-    "return_info": None,
+    "queues": {},
 }
 
-# 一个 threading.Event，用于在新的交互式数据到达时发出信号。
-# 节点的 execute 方法将等待此事件。
-NEW_DATA_EVENT = threading.Event()
+def get_session_queue(session_id=DEFAULT_SESSION):
+    """返回指定会话的帧队列，不存在时创建。"""
+    session_id = str(session_id or DEFAULT_SESSION)
+    with SESSIONS["lock"]:
+        queue = SESSIONS["queues"].get(session_id)
+        if queue is None:
+            queue = SESSIONS["queues"][session_id] = FrameQueue()
+        return queue
+
+# 进行中的分块上传
+UPLOADS = UploadManager()
+
+# 每个会话最近的原始通道帧，作为脏矩形增量的基准
+RETAINED_FRAMES = RetainedFrames()
+
+def expire_waiting_frames():
+    """让所有会话中等待超时的挂起帧回复 busy，返回剩余挂起帧中最早的截止时间（time.monotonic），没有时返回 None。"""
+    with SESSIONS["lock"]:
+        queues = list(SESSIONS["queues"].values())
+    deadlines = [d for d in (queue.expire_waiting() for queue in queues) if d is not None]
+    return min(deadlines, default=None)
+
+def get_session_stats():
+    """返回所有会话的队列统计信息。"""
+    with SESSIONS["lock"]:
+        queues = dict(SESSIONS["queues"])
+    return {session_id: queue.stats() for session_id, queue in queues.items()}
 
 # 服务器线程的全局引用，以确保只有一个正在运行。
 SERVER_THREAD = None
 
-def get_comfy_temp_directory():
-    """返回 ComfyUI 临时目录，并确保它存在。"""
-    temp_dir = folder_paths.get_temp_directory()
-    os.makedirs(temp_dir, exist_ok=True)
-    return temp_dir
-
 def sanitize_filename(filename):
     """
     通过删除目录遍历字符来清理文件名。
@@ -38,89 +84,444 @@ def sanitize_filename(filename):
     """
     return os.path.basename(str(filename))
 
+def write_temp_file(image_data, original_filename, session_id=DEFAULT_SESSION):
+    """
+    将接收到的数据写入受管理的临时存储（磁盘后备模式），返回 FrameRef。
+    相同内容的帧只写入一次；文件在不再被任何管道引用后按存储预算自动清理。
+    """
+    with STATS.timed(session_id, "hash", image_data.nbytes):
+        content_hash = compute_content_hash(image_data)
+    with STATS.timed(session_id, "temp_write", image_data.nbytes):
+        return TEMP_STORE.put_bytes(image_data, original_filename, content_hash)
+
+def split_envelope(parts):
+    """
+    将 ROUTER 收到的消息拆分为 (路由信封, 消息体)。
+    REQ 客户端的信封以空帧结尾；DEALER 客户端可能只有身份帧。
+    """
+    for i, part in enumerate(parts[:-1]):
+        if len(part) == 0:
+            return parts[:i + 1], parts[i + 1:]
+    return parts[:1], parts[1:]
+
+def build_file_info(metadata, image_data=None, ref=None):
+    """为一帧数据构建传递给 DataHub 的文件信息。image_data 为内存缓冲区，ref 为临时存储中文件的 FrameRef。"""
+    original_filename = sanitize_filename(metadata.get("filename", "image.png"))
+    file_info = {
+        "type": metadata.get("render_type", "render"), # 'multilayer_exr', 'image', etc.
+        "original_name": original_filename,
+    }
+    if image_data is not None:
+        file_info["size"] = image_data.nbytes
+        # 在工作线程中计算内容哈希，供 DataHub 的解码缓存使用；缓存被禁用时不计算，避免拖慢每一帧
+        if FRAME_CACHE.enabled:
+            with STATS.timed(metadata.get("session_id"), "hash", image_data.nbytes):
+                file_info["content_hash"] = compute_content_hash(image_data)
+        # 内存模式: 直接在管道中传递缓冲区，跳过磁盘往返
+        file_info["data"] = image_data
+    if ref is not None:
+        file_info["size"] = os.path.getsize(ref.path)
+        file_info["path"] = ref.path
+        # 已知内容哈希，DataHub 不需要按路径和修改时间识别文件
+        file_info["content_hash"] = ref.content_hash
+        # 引用随帧信息传递，管道被释放后文件才可能被清理
+        file_info["store_ref"] = ref
+    return file_info
+
+def enqueue_frame(metadata, file_info, finalize=None):
+    """
+    将一帧放入其会话的队列，返回回复字典。finalize(reply) 在回复发送前调用，可补充回复字段。
+    "block" 策略下队列已满时，如果当前请求可以延迟回复（见 REQUEST_CONTEXT），帧连同回复一起挂起并返回 None：
+    工作线程立即释放，回复在有空位（或超时）时经服务器线程发送给 Blender。
+    """
+    session_id = str(metadata.get("session_id") or DEFAULT_SESSION)
+    queue = get_session_queue(session_id)
+
+    # 将帧放入会话队列，以便 Receiver 节点可以获取
+    frame = {
+        "files": [file_info],
+        "metadata": metadata,
+        "return_info": metadata.get("return_info"),
+        "session_id": session_id,
+        "enqueued_at": time.perf_counter(),
+    }
+    trace = STATS.current_trace()
+    if trace is not None:
+        # 逐帧追踪: 记录随帧传递给 DataHub 和 Sender
+        frame["trace"] = trace
+
+    def build_reply(sequence, message=None):
+        if sequence is None:
+            message = message or f"帧队列已满 ({queue.maxlen})，等待 {DEFAULT_BLOCK_TIMEOUT} 秒后超时。"
+            print(f"[BlenderBridge] 会话 '{session_id}': {message}")
+            reply = {"status": "busy", "message": message, "session_id": session_id, "queue": queue.stats()}
+        else:
+            if trace is not None:
+                trace["sequence"] = sequence
+            reply = {"status": "ok", "message": "Interactive data received.", "session_id": session_id, "sequence": sequence, "queue": queue.stats()}
+        if finalize is not None:
+            finalize(reply)
+        return reply
+
+    # "block" 策略下延迟对 Blender 的回复即为背压；挂起的帧不占用工作线程
+    defer_reply = getattr(REQUEST_CONTEXT, "defer_reply", None)
+    on_admit = None
+    if defer_reply is not None:
+        on_admit = lambda sequence: defer_reply(build_reply(sequence))
+    try:
+        sequence = queue.put(frame, on_admit=on_admit)
+    except QueueFullError as e:
+        return build_reply(None, str(e))
+    if sequence is None:
+        print(f"[BlenderBridge] 会话 '{session_id}' 的帧队列已满，帧已挂起，等待空位后回复。")
+        return None
+    return build_reply(sequence)
+
+def timed_hash(metadata, buffer):
+    with STATS.timed(metadata.get("session_id"), "hash", buffer.nbytes):
+        return compute_content_hash(buffer)
+
+def validate_raw_pass(desc, buffer):
+    """
+    在入队前校验一个原始通道的描述，返回 (name, dtype, shape, compression)。
+    不支持的 dtype、本机不可用的压缩方式或与形状不符的字节数会抛出 ValueError，
+    由请求处理回复错误，而不是等到 DataHub 解码时才失败。
+    """
+    name = str(desc.get("name") or "")
+    if not name:
+        raise ValueError("raw_passes 通道缺少 name 字段。")
+    dtype = str(desc.get("dtype", "float32"))
+    if dtype not in RAW_DTYPES:
+        raise ValueError(f"通道 '{name}' 的 dtype '{dtype}' 不受支持，可用: {list(RAW_DTYPES)}。")
+    shape = [int(d) for d in desc.get("shape") or ()]
+    if len(shape) not in (2, 3) or any(d <= 0 for d in shape):
+        raise ValueError(f"通道 '{name}' 的形状 {shape} 无效，应为 (H, W) 或 (H, W, C)。")
+    compression = desc.get("compression") or "none"
+    if not compression_available(compression):
+        raise ValueError(f"通道 '{name}' 的压缩方式 '{compression}' 在本机不可用。")
+    if compression == "none":
+        # 压缩数据的大小只有解压后才能确定，由解码时的 reshape 检查
+        expected = int(np.prod(shape, dtype=np.int64)) * np.dtype(dtype).itemsize
+        if buffer.nbytes != expected:
+            raise ValueError(f"通道 '{name}' 的数据为 {buffer.nbytes} 字节，形状 {shape} ({dtype}) 应为 {expected} 字节。")
+    return name, dtype, shape, compression
+
+def build_raw_passes_info(metadata, parts):
+    """
+    为原始通道格式 (render_type == "raw_passes") 构建文件信息。
+    metadata["passes"] 按顺序描述 parts[1:] 中的每个通道: name, dtype, shape, 可选 compression / flip_y。
+    """
+    passes = metadata.get("passes") or []
+    if len(parts) - 1 != len(passes):
+        raise ValueError(f"raw_passes 请求声明了 {len(passes)} 个通道，但收到了 {len(parts) - 1} 个数据部分。")
+    # 哈希只用于解码缓存；缓存被禁用时跳过，原始通道是延迟最低的路径
+    hashing = FRAME_CACHE.enabled
+    pass_infos = []
+    for desc, part in zip(passes, parts[1:]):
+        buffer = part.buffer
+        name, dtype, shape, compression = validate_raw_pass(desc, buffer)
+        pass_infos.append({
+            "name": name,
+            "dtype": dtype,
+            "shape": shape,
+            "compression": compression,
+            "flip_y": bool(desc.get("flip_y", False)),
+            # 每个通道单独计算哈希，整帧的哈希由各通道哈希组合而成
+            "digest": timed_hash(metadata, buffer) if hashing else None,
+            "data": buffer,
+        })
+    return {
+        "type": "raw_passes",
+        "original_name": sanitize_filename(metadata.get("filename", "raw_passes")),
+        "size": sum(p["data"].nbytes for p in pass_infos),
+        "content_hash": combine_pass_digests(pass_infos) if hashing else None,
+        "passes": pass_infos,
+    }
+
+def handle_raw_passes(metadata, parts):
+    """
+    处理原始通道帧或其脏矩形增量（带 base_frame_id），返回回复字典。
+    入队的帧会按 frame_id（未提供时使用序列号）保留，供之后的增量引用。
+    """
+    session_id = str(metadata.get("session_id") or DEFAULT_SESSION)
+    base_frame_id = metadata.get("base_frame_id")
+    if base_frame_id is not None:
+        try:
+            file_info = apply_delta(RETAINED_FRAMES.get(session_id, base_frame_id), metadata, parts)
+        except DeltaError as e:
+            print(f"[BlenderBridge] 无法应用增量: {e}")
+            return {"status": "need_full_frame", "message": str(e), "session_id": session_id}
+        print(f"[BlenderBridge] 收到基于帧 {base_frame_id} 的 {len(parts) - 1} 个脏矩形 ({file_info['delta_bytes']} 字节)。")
+    else:
+        # 原始通道格式: 每个通道一个数据部分，始终保留在内存中，由 DataHub 直接转换为张量
+        file_info = build_raw_passes_info(metadata, parts)
+        print(f"[BlenderBridge] 收到 {len(file_info['passes'])} 个原始通道 ({file_info['size']} 字节)。")
+
+    def retain(reply):
+        if reply["status"] == "ok":
+            frame_id = metadata.get("frame_id", reply["sequence"])
+            RETAINED_FRAMES.retain(session_id, frame_id, file_info)
+            reply["frame_id"] = frame_id
+
+    return enqueue_frame(metadata, file_info, retain)
+
+def handle_interactive(metadata, parts):
+    """处理一帧交互式数据（在工作线程中运行），返回回复字典。"""
+    print("[BlenderBridge] 检测到交互模式数据。")
+
+    if metadata.get("render_type") == "raw_passes":
+        # 原始通道帧自行校验数据部分的数量（没有脏矩形的增量帧只有元数据）
+        return handle_raw_passes(metadata, parts)
+
+    if len(parts) < 2:
+        raise ValueError("交互模式请求需要元数据和图像数据部分。")
+
+    # 第二部分是图像数据 (零拷贝的内存视图，引用底层的 zmq.Frame)
+    image_data = parts[1].buffer
+    transport = str(metadata.get("transport", DEFAULT_TRANSPORT)).lower()
+
+    if transport == "disk":
+        # 磁盘后备: 将图像保存到 ComfyUI 的临时目录
+        original_filename = sanitize_filename(metadata.get("filename", "image.png"))
+        file_info = build_file_info(metadata, ref=write_temp_file(image_data, original_filename, metadata.get("session_id")))
+        print(f"[BlenderBridge] 交互式图像已保存到临时文件: {file_info['path']}")
+    else:
+        file_info = build_file_info(metadata, image_data=image_data)
+        print(f"[BlenderBridge] 交互式图像已保留在内存中 ({image_data.nbytes} 字节)。")
+
+    return enqueue_frame(metadata, file_info)
+
+def handle_upload(request_type, metadata, parts):
+    """处理分块上传协议的各类请求（在工作线程中运行），返回回复字典。"""
+    if request_type == "upload_begin":
+        transport = str(metadata.get("transport", DEFAULT_TRANSPORT)).lower()
+        original_filename = sanitize_filename(metadata.get("filename", "image.png"))
+        temp_path_factory = None
+        if transport == "disk":
+            # 在临时存储目录中暂存，完成后按内容哈希登记
+            temp_path_factory = lambda upload_id: TEMP_STORE.staging_path(upload_id, original_filename)
+        upload, resumed = UPLOADS.begin(metadata, temp_path_factory)
+        print(f"[BlenderBridge] {'继续' if resumed else '开始'}分块上传 {upload.upload_id} ({upload.total_size} 字节, {upload.chunk_count} 块)。")
+        return {"status": "ok", "resumed": resumed, "missing_chunks": upload.missing_chunks(), **upload.progress()}
+
+    upload_id = metadata.get("upload_id")
+    if request_type == "upload_abort":
+        return {"status": "ok", "upload_id": upload_id, "aborted": UPLOADS.abort(upload_id)}
+
+    if request_type == "upload_chunk":
+        # 顺便清理被放弃的上传，避免数 GB 的内存缓冲区一直等到下一次 upload_begin 才释放
+        UPLOADS.expire()
+    upload = UPLOADS.get(upload_id)
+
+    if request_type == "upload_chunk":
+        if len(parts) < 2:
+            raise UploadError("upload_chunk 请求需要元数据和数据块两部分。")
+        # 数据块以零拷贝方式接收，直接写入预分配的目标
+        upload.write_chunk(int(metadata.get("index", 0)), parts[1].buffer)
+        return {"status": "ok", **upload.progress()}
+
+    if request_type == "upload_status":
+        return {"status": "ok", "missing_chunks": upload.missing_chunks(), **upload.progress()}
+
+    # upload_end
+    if not upload.is_complete():
+        return {"status": "incomplete", "missing_chunks": upload.missing_chunks(), **upload.progress()}
+    UPLOADS.pop(upload.upload_id)
+    # 帧的元数据来自 upload_begin，upload_end 中的字段可以覆盖它
+    frame_metadata = {**upload.metadata, **{k: v for k, v in metadata.items() if k not in ("type", "upload_id")}}
+    frame_metadata["type"] = upload.metadata.get("type")
+    result = upload.finish()
+    if isinstance(result, str):
+        with STATS.timed(frame_metadata.get("session_id"), "hash", upload.total_size):
+            ref = TEMP_STORE.adopt(result, sanitize_filename(frame_metadata.get("filename", "image.png")))
+        file_info = build_file_info(frame_metadata, ref=ref)
+    else:
+        file_info = build_file_info(frame_metadata, image_data=result)
+    progress = upload.progress()
+    print(f"[BlenderBridge] 分块上传 {upload.upload_id} 完成 ({upload.total_size} 字节, 用时 {progress['elapsed']:.2f} 秒)。")
+    return enqueue_frame(frame_metadata, file_info, lambda reply: reply.update(upload_id=upload.upload_id))
+
+UPLOAD_REQUEST_TYPES = ("upload_begin", "upload_chunk", "upload_end", "upload_status", "upload_abort")
+
+def handle_request(metadata, parts):
+    """在工作线程中处理一个非 ping 请求，返回回复字典。"""
+    request_type = metadata.get("type")
+
+    # --- 分块上传 ---
+    if request_type in UPLOAD_REQUEST_TYPES:
+        return handle_upload(request_type, metadata, parts)
+
+    # --- 交互模式 ---
+    # 其余请求都被视为交互式数据。
+    return handle_interactive(metadata, parts)
+
+def handle_stats(metadata):
+    """
+    处理 "stats" 请求，返回各阶段的统计信息。
+    可选字段: format ("json" 或 "prometheus")、trace (开启/关闭逐帧追踪)、reset (清空统计)。
+    """
+    if "trace" in metadata:
+        STATS.set_trace(metadata["trace"])
+    gauges = {
+        "cache": FRAME_CACHE.stats(),
+        "uploader": UPLOADER.stats(),
+        "temp_store": TEMP_STORE.stats(),
+        "output_store": OUTPUT_STORE.stats(),
+    }
+    if str(metadata.get("format", "json")).lower() == "prometheus":
+        reply = {"status": "ok", "format": "prometheus", "text": STATS.to_prometheus(gauges)}
+    else:
+        reply = {
+            "status": "ok", "format": "json",
+            "stages": STATS.snapshot(),
+            "queues": get_session_stats(),
+            "trace_enabled": STATS.trace_enabled,
+            "traces": STATS.recent_traces(),
+            **gauges,
+        }
+    if metadata.get("reset"):
+        STATS.reset()
+    return reply
+
 def zmq_server_worker():
     """
-    在后台线程中运行，使用多部分消息协议监听来自 Blender 的请求。
+    在后台线程中运行，使用 ROUTER 套接字同时为多个 Blender 客户端服务。
+    ping 在服务器线程中立即回复；上传等耗时请求交给工作线程池处理，
+    因此一个客户端的大文件上传不会阻塞其他客户端。
     """
     context = zmq.Context()
-    socket = context.socket(zmq.REP)
-    address = "tcp://127.0.0.1:5555"
+    socket = context.socket(zmq.ROUTER)
+    address = SERVER_ADDRESS
     print(f"[BlenderBridge] 正在启动 ZeroMQ 服务器，绑定到 {address}...")
     socket.bind(address)
+
+    # 工作线程通过 PUSH 套接字将 [信封..., 回复] 发回这里，由服务器线程发送给客户端
+    reply_socket = context.socket(zmq.PULL)
+    reply_socket.bind(REPLY_ADDRESS)
     
     decoder = msgspec.msgpack.Decoder()
     encoder = msgspec.msgpack.Encoder()
+    pool = ThreadPoolExecutor(max_workers=SERVER_WORKERS, thread_name_prefix="BlenderBridge-IO")
+    local = threading.local()
+
+    def worker_push():
+        push = getattr(local, "push", None)
+        if push is None:
+            push = local.push = context.socket(zmq.PUSH)
+            push.connect(REPLY_ADDRESS)
+        return push
+
+    def send_from_worker(envelope, reply):
+        worker_push().send_multipart(list(envelope) + [msgspec.msgpack.encode(reply)], copy=False)
+
+    def run_request(envelope, metadata, parts, received_at):
+        session_id = metadata.get("session_id")
+        # 从服务器线程收到消息到工作线程开始处理的等待时间
+        STATS.record(session_id, "dispatch_wait", time.perf_counter() - received_at, trace=False)
+        STATS.begin_trace(session_id, force=bool(metadata.get("trace")))
+        # 挂起的帧入队（或超时）时由 Receiver 节点或服务器线程调用，回复仍经服务器线程发送
+        REQUEST_CONTEXT.defer_reply = lambda reply: deliver_reply(envelope, reply)
+        try:
+            with STATS.timed(session_id, "ingest", sum(p.buffer.nbytes for p in parts[1:])):
+                reply = handle_request(metadata, parts)
+        except Exception as e:
+            print(f"[BlenderBridge] 服务器在处理请求时遇到错误: {e}")
+            reply = {"status": "error", "message": str(e)}
+        finally:
+            STATS.end_trace_scope()
+            REQUEST_CONTEXT.defer_reply = None
+        # None 表示回复已被延迟（帧在 "block" 队列外等待空位）
+        if reply is not None:
+            deliver_reply(envelope, reply)
+        else:
+            # 服务器线程可能正在无超时地等待，发送一个空消息唤醒它，按新挂起帧的截止时间重新计算超时
+            worker_push().send(b"")
+
+    def deliver_reply(envelope, reply):
+        try:
+            send_from_worker(envelope, reply)
+        except Exception as send_e:
+            print(f"[BlenderBridge] 无法发送回复给 Blender: {send_e}")
+
+    poller = zmq.Poller()
+    poller.register(socket, zmq.POLLIN)
+    poller.register(reply_socket, zmq.POLLIN)
 
     try:
         while True:
-            try:
-                # 阻塞并等待来自 Blender 的多部分消息
-                parts = socket.recv_multipart()
-                
-                # 第一部分是元数据
-                metadata = decoder.decode(parts[0])
-                print(f"[BlenderBridge] 收到请求, 元数据: {metadata.get('type', 'N/A')}")
-
-                request_type = metadata.get("type")
-
-                # 1. 处理 Ping 请求 (握手)
-                if request_type == "ping":
-                    print("[BlenderBridge] 收到 Ping 请求，正在回复 Pong...")
-                    reply = {"status": "ok", "message": "pong"}
-                    socket.send(encoder.encode(reply))
-                    continue
-
-                # --- 交互模式 ---
-                # 所有非 ping 请求都被视为交互式数据。
-                print("[BlenderBridge] 检测到交互模式数据。")
-                
-                if len(parts) < 2:
-                    raise ValueError("交互模式请求需要元数据和图像数据部分。")
-                
-                # 第二部分是图像数据
-                image_data = parts[1]
-                original_filename = sanitize_filename(metadata.get("filename", "image.png"))
-                
-                # 将图像保存到 ComfyUI 的临时目录
-                temp_dir = get_comfy_temp_directory()
-                temp_path = os.path.join(temp_dir, f"{uuid.uuid4()}_{original_filename}")
-                
-                with open(temp_path, "wb") as f:
-                    f.write(image_data)
-                
-                print(f"[BlenderBridge] 交互式图像已保存到临时文件: {temp_path}")
-                
-                # 准备要传递给 DataHub 节点的数据
-                file_info = {
-                    "path": temp_path,
-                    "type": metadata.get("render_type", "render"), # 'multilayer_exr', 'image', etc.
-                    "original_name": original_filename,
-                }
-
-                # 更新全局状态，以便 Receiver 节点可以获取
-                with LATEST_DATA["lock"]:
-                    LATEST_DATA["files"] = [file_info]
-                    LATEST_DATA["metadata"] = metadata
-                    LATEST_DATA["return_info"] = metadata.get("return_info")
-
-                # 发出新数据可用的信号
-                NEW_DATA_EVENT.set()
-                
-                reply = {"status": "ok", "message": "Interactive data received."}
-                socket.send(encoder.encode(reply))
-
-            except Exception as e:
-                print(f"[BlenderBridge] 服务器在处理请求时遇到错误: {e}")
-                # 即使有错误，也尝试向Blender发送一个回复，以防止其卡在等待状态
+            # 有挂起的帧时，在其最早的截止时间醒来回复 busy
+            next_deadline = expire_waiting_frames()
+            poll_timeout = None if next_deadline is None else max(0, int((next_deadline - time.monotonic()) * 1000) + 1)
+            events = dict(poller.poll(poll_timeout))
+
+            # 转发工作线程完成的回复；单个空消息只是唤醒信号
+            if reply_socket in events:
+                while True:
+                    try:
+                        reply_parts = reply_socket.recv_multipart(zmq.NOBLOCK, copy=False)
+                    except zmq.Again:
+                        break
+                    if len(reply_parts) > 1:
+                        socket.send_multipart(reply_parts, copy=False)
+
+            if socket not in events:
+                continue
+
+            while True:
+                try:
+                    # copy=False 返回 zmq.Frame，其 .buffer 可以零拷贝地访问接收到的数据
+                    raw_parts = socket.recv_multipart(zmq.NOBLOCK, copy=False)
+                except zmq.Again:
+                    break
+
+                received_at = time.perf_counter()
+                envelope, parts = split_envelope(raw_parts)
                 try:
-                    error_reply = {"status": "error", "message": str(e)}
-                    socket.send(encoder.encode(error_reply))
-                except Exception as send_e:
-                    print(f"[BlenderBridge] 无法发送错误回复给 Blender: {send_e}")
+                    if not parts:
+                        raise ValueError("请求缺少元数据部分。")
+                    # 第一部分是元数据
+                    metadata = decoder.decode(parts[0].buffer)
+                    print(f"[BlenderBridge] 收到请求, 元数据: {metadata.get('type', 'N/A')}")
+
+                    request_type = metadata.get("type")
+
+                    # 1. 处理 Ping 请求 (握手)，直接在服务器线程中回复
+                    if request_type == "ping":
+                        print("[BlenderBridge] 收到 Ping 请求，正在回复 Pong...")
+                        # 清理超时的上传（可能需要等待写入完成和删除文件，交给工作线程）
+                        pool.submit(UPLOADS.expire)
+                        session_id = str(metadata.get("session_id") or DEFAULT_SESSION)
+                        reply = {
+                            "status": "ok", "message": "pong",
+                            "queue": get_session_queue(session_id).stats(),
+                            "sessions": get_session_stats(),
+                            # 分块上传的进度也通过 ping 报告
+                            "uploads": UPLOADS.progress(),
+                        }
+                        socket.send_multipart(envelope + [encoder.encode(reply)], copy=False)
+                        continue
+
+                    # 2. 统计信息查询，同样直接回复
+                    if request_type == "stats":
+                        socket.send_multipart(envelope + [encoder.encode(handle_stats(metadata))], copy=False)
+                        continue
+
+                    # 3. 其他请求交给工作线程池
+                    pool.submit(run_request, envelope, metadata, parts, received_at)
+
+                except Exception as e:
+                    print(f"[BlenderBridge] 服务器在处理请求时遇到错误: {e}")
+                    # 即使有错误，也尝试向Blender发送一个回复，以防止其卡在等待状态
+                    try:
+                        error_reply = {"status": "error", "message": str(e)}
+                        socket.send_multipart(envelope + [encoder.encode(error_reply)], copy=False)
+                    except Exception as send_e:
+                        print(f"[BlenderBridge] 无法发送错误回复给 Blender: {send_e}")
     finally:
         print("[BlenderBridge] 正在关闭 ZeroMQ 服务器...")
-        socket.close()
-        context.term()
+        pool.shutdown(wait=False)
+        # destroy 会同时关闭工作线程创建的 PUSH 套接字
+        context.destroy(linger=0)
 
 def start_server_thread():
     """启动 ZMQ 服务器线程（如果尚未运行）。"""
@@ -141,7 +542,21 @@ class BlenderBridge_Receiver:
 
     @classmethod
     def INPUT_TYPES(cls):
-        return {"required": {}}
+        # session_id: 要消费的会话；Blender 在元数据中通过 "session_id" 指定，未指定时为 "default"
+        # queue_policy / queue_size 在节点执行时应用到该会话的帧队列；
+        # 在此之前使用环境变量 BLENDER_BRIDGE_QUEUE_POLICY / BLENDER_BRIDGE_QUEUE_SIZE 的默认值
+        # batch_size: 一次取出并合并到同一个管道中的帧数（动画），DataHub 会输出 (N, H, W, C) 的批次；
+        # batch_timeout: 收到第一帧后最多等待多少秒凑齐 batch_size 帧，超时则输出已到达的帧
+        return {
+            "required": {},
+            "optional": {
+                "session_id": ("STRING", {"default": DEFAULT_SESSION}),
+                "queue_policy": (list(QUEUE_POLICIES), {"default": DEFAULT_QUEUE_POLICY}),
+                "queue_size": ("INT", {"default": DEFAULT_QUEUE_SIZE, "min": 1, "max": 1024}),
+                "batch_size": ("INT", {"default": 1, "min": 1, "max": 1024}),
+                "batch_timeout": ("FLOAT", {"default": 5.0, "min": 0.0, "max": 600.0, "step": 0.1}),
+            },
+        }
 
     RETURN_TYPES = ("BRIDGE_PIPE",)
     RETURN_NAMES = ("bridge_pipe",)
@@ -149,28 +564,47 @@ class BlenderBridge_Receiver:
     CATEGORY = "Blender Bridge"
     
     @classmethod
-    def IS_CHANGED(cls, **kwargs):
-        # 等待来自 ZMQ 线程的事件
-        is_new_data = NEW_DATA_EVENT.wait(timeout=0.01)
-        if is_new_data:
-            return float("NaN") # 返回 NaN 强制 ComfyUI 重新运行此节点
+    def IS_CHANGED(cls, session_id=DEFAULT_SESSION, **kwargs):
+        # 会话队列中有未消费的帧时，返回 NaN 强制 ComfyUI 重新运行此节点
+        if get_session_queue(session_id).has_data():
+            return float("NaN")
         return 0
 
-    def execute(self):
-        print("[BlenderBridge-Receiver] 等待来自 Blender 的交互式数据...")
+    def execute(self, session_id=DEFAULT_SESSION, queue_policy=DEFAULT_QUEUE_POLICY, queue_size=DEFAULT_QUEUE_SIZE,
+                batch_size=1, batch_timeout=5.0):
+        queue = get_session_queue(session_id)
+        if batch_size > 1 and queue_policy == "latest":
+            print(f"[BlenderBridge-Receiver] 警告: 'latest' 策略只保留最新的一帧，batch_size={batch_size} 需要 'keep_all' 或 'block' 策略。")
+        # 队列至少要能容纳一个完整的批次，否则 keep_all 会丢帧、block 永远凑不齐
+        queue.configure(maxlen=max(queue_size, batch_size), policy=queue_policy)
+        print(f"[BlenderBridge-Receiver] 等待来自 Blender 的交互式数据 (会话 '{session_id}')...")
         
-        # 阻塞直到接收到新数据
-        NEW_DATA_EVENT.wait()
+        # 阻塞直到接收到新数据；批处理时再等待其余的帧
+        frames = queue.get_batch(batch_size, gather_timeout=batch_timeout if batch_size > 1 else 0.0)
+        now = time.perf_counter()
+        for frame in frames:
+            # 帧在队列中等待 Receiver 节点执行的时间
+            STATS.record(frame["session_id"], "queue_wait", now - frame["enqueued_at"], trace=frame.get("trace"))
+        first = frames[0]
         
-        with LATEST_DATA["lock"]:
-            # 复制数据以避免竞争条件
-            pipe_data = {
-                "files": list(LATEST_DATA["files"]),
-                "metadata": dict(LATEST_DATA["metadata"]),
-                "return_info": dict(LATEST_DATA["return_info"]) if LATEST_DATA["return_info"] else None,
-            }
-            # 消费事件，以便下次可以再次等待
-            NEW_DATA_EVENT.clear()
+        # 复制数据以避免竞争条件。files 按帧顺序排列，frames 保存每帧各自的元数据和追踪记录；
+        # 顶层的 metadata / return_info 来自第一帧
+        pipe_data = {
+            "files": [file_info for frame in frames for file_info in frame["files"]],
+            "metadata": dict(first["metadata"]),
+            "return_info": dict(first["return_info"]) if first["return_info"] else None,
+            "sequence": first["sequence"],
+            "session_id": first["session_id"],
+            "trace": first.get("trace"),
+            "frames": [
+                {"sequence": frame["sequence"], "metadata": dict(frame["metadata"]), "trace": frame.get("trace")}
+                for frame in frames
+            ],
+        }
         
-        print("[BlenderBridge-Receiver] 已收到交互式数据。将管道传递到下游。")
-        return (pipe_data,) 
\ No newline at end of file
+        stats = queue.stats()
+        if len(frames) > 1:
+            print(f"[BlenderBridge-Receiver] 已收到第 {first['sequence']}-{frames[-1]['sequence']} 帧，共 {len(frames)} 帧 (队列剩余 {stats['depth']}/{stats['capacity']}，已丢弃 {stats['dropped']})。将管道传递到下游。")
+        else:
+            print(f"[BlenderBridge-Receiver] 已收到第 {first['sequence']} 帧 (队列剩余 {stats['depth']}/{stats['capacity']}，已丢弃 {stats['dropped']})。将管道传递到下游。")
+        return (pipe_data,)
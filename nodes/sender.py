@@ -1,23 +1,42 @@
-# nodes/sender.py
 import torch
-import folder_paths
+import io
 import os
 from PIL import Image
 import numpy as np
 import json
-import urllib.request
-import urllib.error
+import time
+from concurrent.futures import ThreadPoolExecutor
+from .uploader import HTTP_POOL, UPLOADER, post_with_retry
+from .shm import SHM_PUBLISHER
+from .encoding import REMOTE_FORMATS, encode_image, negotiate_format
+from .stats import STATS
+from .frame_store import OUTPUT_STORE
+
+# 本地模式的传输方式: 共享内存 (原始像素) 或输出目录中的 PNG 文件
+LOCAL_TRANSFERS = ["auto", "shared_memory", "file"]
+# 共享内存中像素数据支持的类型
+PIXEL_DTYPES = ("uint8", "float16", "float32")
+
+def tensor_to_array(tensor, dtype="uint8"):
+    """将单帧图像张量转换为 (H, W, C) 的 numpy 数组。uint8 会缩放到 [0, 255]，浮点类型保留原始数值。"""
+    frame = tensor.detach()
+    # 移除批处理维度；批次应先按帧拆分（见 send_batch）
+    if frame.dim() == 4:
+        if frame.shape[0] != 1:
+            raise ValueError(f"tensor_to_array 只接受单帧图像，收到了 {frame.shape[0]} 帧的批次。")
+        frame = frame[0]
+    if dtype == "uint8":
+        # 将数据范围从 [0, 1] 转换为 [0, 255]
+        frame = frame.mul(255).clamp(0, 255).byte()
+    else:
+        frame = frame.to(getattr(torch, dtype))
+    return frame.cpu().numpy()
 
 def tensor_to_pil(tensor):
     """将输入的 PyTorch 张量转换为 PIL.Image 对象。"""
-    # 移除批处理维度, 将数据范围从 [0, 1] 转换为 [0, 255]
-    image_np = tensor.squeeze(0).mul(255).clamp(0, 255).byte().cpu().numpy()
-    return Image.fromarray(image_np, 'RGB')
+    return Image.fromarray(tensor_to_array(tensor, "uint8"), 'RGB')
 
 class BlenderBridge_Sender:
-    def __init__(self):
-        self.output_dir = folder_paths.get_output_directory()
-
     @classmethod
     def INPUT_TYPES(cls):
         return {
@@ -25,6 +44,17 @@ class BlenderBridge_Sender:
                 "image": ("IMAGE",),
                 "bridge_pipe": ("BRIDGE_PIPE",),
             },
+            # send_mode: "sync" 在当前线程中编码并发送；
+            # "async" 将任务放入后台队列后立即返回，同一目标图像只发送最新的一帧
+            # local_transfer: 本地模式的传输方式，"auto" 使用 return_info 中 Blender 声明的 local_transfer
+            # remote_format: 远程模式的载荷格式，"auto" 按 return_info["accept_formats"] 协商
+            # compress_level: PNG 的 zlib 压缩级别，较低的级别用 CPU 换带宽
+            "optional": {
+                "send_mode": (["sync", "async"], {"default": "sync"}),
+                "local_transfer": (LOCAL_TRANSFERS, {"default": "auto"}),
+                "remote_format": (["auto"] + list(REMOTE_FORMATS), {"default": "auto"}),
+                "compress_level": ("INT", {"default": 6, "min": 0, "max": 9}),
+            },
         }
 
     RETURN_TYPES = ()
@@ -33,7 +63,7 @@ class BlenderBridge_Sender:
     CATEGORY = "Blender Bridge"
     OUTPUT_NODE = True # 这是一个终点节点
 
-    def execute(self, image, bridge_pipe):
+    def execute(self, image, bridge_pipe, send_mode="sync", local_transfer="auto", remote_format="auto", compress_level=6):
         if not bridge_pipe or "return_info" not in bridge_pipe or not bridge_pipe["return_info"]:
             print("[BlenderBridge-Sender] 警告: bridge_pipe 中缺少 return_info，跳过发送。")
             return {}
@@ -45,59 +75,144 @@ class BlenderBridge_Sender:
         if not server_address or not image_name:
             print("[BlenderBridge-Sender] 警告: return_info 中缺少必要信息，跳过发送。")
             return {}
-        
-        # 将张量图像转换为 PIL Image
-        pil_image = tensor_to_pil(image)
 
+        if local_transfer == "auto":
+            local_transfer = return_info.get("local_transfer", "file")
+        pixel_dtype = return_info.get("pixel_dtype", "uint8")
+        if pixel_dtype not in PIXEL_DTYPES:
+            pixel_dtype = "uint8"
+        format_spec = negotiate_format(return_info, remote_format)
+        format_spec.setdefault("compress_level", compress_level)
+        session_id = bridge_pipe.get("session_id")
+        # 每帧的元数据和追踪记录（批处理管道中每帧一个），用于帧编号请求头和逐帧追踪
+        frames = bridge_pipe.get("frames") or [{"metadata": bridge_pipe.get("metadata") or {}, "trace": bridge_pipe.get("trace")}]
+
+        if send_mode == "async":
+            # 编码和发送都在后台线程中完成，节点立即返回；整个批次作为一个任务
+            image = image.detach()
+            count = image.shape[0] if image.dim() == 4 else 1
+            # 单帧（交互式）任务按目标图像合并，只发送最新的一帧；
+            # 动画批次不会被替换或丢弃（后台队列为每次提交分配唯一的键），否则会丢失帧
+            batch = count > 1
+            UPLOADER.submit(
+                server_address, image_name,
+                lambda: self.send_batch(image, server_address, image_name, local_transfer, pixel_dtype, format_spec, session_id, frames),
+                coalesce=not batch,
+            )
+            print(f"[BlenderBridge-Sender] 已将图像 '{image_name}' ({image.shape[0]} 帧) 加入后台发送队列。")
+            return {}
+
+        try:
+            self.send_batch(image, server_address, image_name, local_transfer, pixel_dtype, format_spec, session_id, frames)
+        except Exception as e:
+            print(f"[BlenderBridge-Sender] 发送图像回 Blender 时出错: {e}")
+
+        return {}
+
+    def send_batch(self, images, server_address, image_name, local_transfer="file", pixel_dtype="uint8", format_spec=None,
+                   session_id=None, frames=None):
+        """
+        发送一个 (N, H, W, C) 的图像批次，每帧一个请求，全部复用到 Blender 的同一个持久连接。
+        发送当前帧的同时在后台线程中编码下一帧。N > 1 时请求带有 X-Blender-Frame-Index / X-Blender-Frame-Count。
+        """
+        frames = frames or []
+        count = images.shape[0] if images.dim() == 4 else 1
+        if count == 1:
+            trace = frames[0].get("trace") if frames else None
+            self.send_image(images, server_address, image_name, local_transfer, pixel_dtype, format_spec, session_id, trace)
+            return
+
+        def encode(index):
+            frame = frames[index] if index < len(frames) else {}
+            started = time.perf_counter()
+            payload, headers = self.encode_frame(
+                images[index:index + 1], server_address, image_name, local_transfer, pixel_dtype, format_spec,
+                index, count, frame.get("metadata"),
+            )
+            return payload, headers, time.perf_counter() - started, frame.get("trace")
+
+        with ThreadPoolExecutor(max_workers=1) as pool:
+            pending = pool.submit(encode, 0)
+            for index in range(count):
+                payload, headers, encode_seconds, trace = pending.result()
+                if index + 1 < count:
+                    pending = pool.submit(encode, index + 1)
+                self.post_frame(payload, headers, server_address, encode_seconds, session_id, trace)
+        print(f"[BlenderBridge-Sender] 成功将图像 '{image_name}' 的 {count} 帧发送回 Blender。")
+
+    def send_image(self, image, server_address, image_name, local_transfer="file", pixel_dtype="uint8", format_spec=None,
+                   session_id=None, trace=None):
+        """编码单帧图像并通过持久连接发送给 Blender。失败时按指数退避重试，最终失败会抛出异常。"""
+        encode_started = time.perf_counter()
+        payload, headers = self.encode_frame(image, server_address, image_name, local_transfer, pixel_dtype, format_spec)
+        self.post_frame(payload, headers, server_address, time.perf_counter() - encode_started, session_id, trace)
+        print(f"[BlenderBridge-Sender] 成功将图像 '{image_name}' 发送回 Blender。")
+
+    def post_frame(self, payload, headers, server_address, encode_seconds, session_id=None, trace=None):
+        """发送已编码的一帧，并记录编码和发送阶段的统计信息。"""
+        # 编码阶段包括共享内存写入、PNG 文件保存或内存中的编码
+        payload_bytes = len(memoryview(payload).cast('B'))
+        STATS.record(session_id, "encode", encode_seconds, payload_bytes, trace)
+
+        # 发送请求（复用到该地址的持久连接）
+        with STATS.timed(session_id, "http_send", payload_bytes, trace):
+            post_with_retry(HTTP_POOL, server_address, "/update_image", payload, headers)
+        STATS.finish_trace(trace)
+
+    def encode_frame(self, image, server_address, image_name, local_transfer="file", pixel_dtype="uint8", format_spec=None,
+                     frame_index=None, frame_count=None, frame_metadata=None):
+        """将单帧图像编码为发送给 Blender 的 (载荷, 请求头)。批次中的帧带有帧序号请求头。"""
         # 准备 HTTP 请求
         headers = {
             "X-Blender-Image-Name": image_name
         }
-        
+        if frame_count is not None:
+            headers["X-Blender-Frame-Index"] = str(frame_index)
+            headers["X-Blender-Frame-Count"] = str(frame_count)
+            # Blender 在元数据中提供的场景帧号（如果有）
+            if frame_metadata and frame_metadata.get("frame") is not None:
+                headers["X-Blender-Frame-Number"] = str(frame_metadata["frame"])
+
         # 智能模式判断
         is_local = "127.0.0.1" in server_address or "localhost" in server_address
 
-        try:
-            if is_local:
-                # --- 本地高速模式 ---
-                # 将图像保存到 ComfyUI 的输出目录
-                file_path, _ = self.save_image_local(pil_image, "blender_bridge_output")
-                print(f"[BlenderBridge-Sender] 本地模式: 图像已保存至 {file_path}")
-
-                # 准备 JSON 载荷
-                payload = json.dumps({"image_path": file_path}).encode('utf-8')
-                headers["Content-Type"] = "application/json"
-                req = urllib.request.Request(f"{server_address}/update_image", data=payload, headers=headers)
-                print(f"[BlenderBridge-Sender] 正在向 Blender 发送路径: {file_path}")
-            else:
-                # --- 远程兼容模式 ---
-                # 在内存中将图像编码为 PNG
-                import io
-                buffer = io.BytesIO()
-                pil_image.save(buffer, format="PNG")
-                payload = buffer.getvalue()
-                
-                headers["Content-Type"] = "image/png"
-                req = urllib.request.Request(f"{server_address}/update_image", data=payload, headers=headers)
-                print(f"[BlenderBridge-Sender] 远程模式: 正在向 Blender 发送图像数据...")
-
-            # 发送请求
-            with urllib.request.urlopen(req) as response:
-                if response.status == 200:
-                    print(f"[BlenderBridge-Sender] 成功将图像 '{image_name}' 发送回 Blender。")
-                else:
-                    error_body = response.read().decode('utf-8', errors='ignore')
-                    print(f"[BlenderBridge-Sender] 发送失败: {response.status} {response.reason}\n详情: {error_body}")
-
-        except Exception as e:
-            print(f"[BlenderBridge-Sender] 发送图像回 Blender 时出错: {e}")
+        if is_local and local_transfer == "shared_memory":
+            # --- 本地共享内存模式 ---
+            # 原始像素写入命名共享内存段，不经过 PNG 压缩和磁盘
+            descriptor = SHM_PUBLISHER.publish(image_name, tensor_to_array(image, pixel_dtype))
+            payload = json.dumps(descriptor).encode('utf-8')
+            headers["Content-Type"] = "application/json"
+            headers["X-Blender-Transfer"] = "shared_memory"
+            print(f"[BlenderBridge-Sender] 共享内存模式: 帧 {descriptor['frame']} 已写入 {descriptor['shm_name']} {descriptor['shape']} {descriptor['dtype']}")
+        elif is_local:
+            # --- 本地文件模式 ---
+            # 将图像保存到输出目录中受管理的存储（相同结果只写入一次，旧结果按预算自动清理）
+            pil_image = tensor_to_pil(image)
+            file_path, _ = self.save_image_local(pil_image, image_name, frame_index)
+            print(f"[BlenderBridge-Sender] 本地模式: 图像已保存至 {file_path}")
 
-        return {}
+            # 准备 JSON 载荷
+            payload = json.dumps({"image_path": file_path}).encode('utf-8')
+            headers["Content-Type"] = "application/json"
+            print(f"[BlenderBridge-Sender] 正在向 Blender 发送路径: {file_path}")
+        else:
+            # --- 远程兼容模式 ---
+            # 按协商的格式在内存中编码 (PNG / 无损 WebP / 原始像素 + lz4/zstd)
+            format_spec = format_spec or {"format": "png"}
+            array_dtype = format_spec.get("dtype", "uint8") if format_spec["format"] == "raw" else "uint8"
+            payload, format_headers = encode_image(tensor_to_array(image, array_dtype), format_spec)
+            headers.update(format_headers)
+            print(f"[BlenderBridge-Sender] 远程模式: 正在向 Blender 发送图像数据 ({headers['Content-Type']}, {len(memoryview(payload).cast('B'))} 字节)...")
+        return payload, headers
 
-    def save_image_local(self, image_pil, filename_prefix):
-        """将 PIL 图像保存到输出目录，并返回完整路径。"""
-        # 使用 ComfyUI 的内建方法来获取带编号的文件名
-        full_output_folder, filename, counter, subfolder, _ = folder_paths.get_save_image_path(filename_prefix, self.output_dir)
-        file_path = os.path.join(full_output_folder, f"{filename}_{counter:05}.png")
-        image_pil.save(file_path)
-        return file_path, f"{filename}_{counter:05}.png" 
\ No newline at end of file
+    def save_image_local(self, image_pil, image_name, frame_index=None):
+        """
+        将 PIL 图像编码为 PNG 并保存到输出存储，返回 (完整路径, 文件名)。
+        文件以内容哈希命名；每个 image_name（批次中每个帧序号）的最新结果保持引用，直到下一次发送替换它。
+        """
+        buffer = io.BytesIO()
+        image_pil.save(buffer, format="PNG")
+        suffix = "" if frame_index is None else f"_{frame_index:05}"
+        ref = OUTPUT_STORE.put_bytes(buffer.getbuffer(), f"{image_name}{suffix}.png")
+        OUTPUT_STORE.pin(("sender", image_name, frame_index), ref)
+        return ref.path, os.path.basename(ref.path) # 用于本地高性能IPC通信
@@ -0,0 +1,101 @@
+# nodes/shm.py
+import atexit
+import itertools
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from multiprocessing import shared_memory
+
+import numpy as np
+
+# --- 本地共享内存返回通道 ---
+# 本地模式下，Sender 不再将 PNG 写入磁盘再由 Blender 解码，而是把原始像素
+# 写入命名共享内存段，只通过 HTTP 告诉 Blender 段名、形状和数据类型。
+# 每个目标图像使用两个段轮流写入（双缓冲），Blender 读取一帧时，
+# 下一帧会写入另一个段；段在尺寸足够时会被复用。
+# 最近最少使用的目标图像超过 SHM_MAX_IMAGES 个，或超过 SHM_IDLE_SECONDS 秒没有新帧时释放其段，
+# 其余的在进程退出时统一释放。
+
+SLOTS_PER_IMAGE = 2
+SHM_MAX_IMAGES = max(1, int(os.environ.get("BLENDER_BRIDGE_SHM_IMAGES", "8")))
+SHM_IDLE_SECONDS = float(os.environ.get("BLENDER_BRIDGE_SHM_IDLE", "300"))
+
+class SharedFramePublisher:
+    def __init__(self):
+        self.lock = threading.Lock()
+        # image_name -> {"slots", "next", "last_used"}，按最近使用顺序排列
+        self.images = OrderedDict()
+        self.frame_counter = itertools.count(1)
+
+    def _segment_for(self, image_name, nbytes):
+        entry = self.images.get(image_name)
+        if entry is None:
+            entry = self.images[image_name] = {"slots": [None] * SLOTS_PER_IMAGE, "next": 0}
+        self.images.move_to_end(image_name)
+        entry["last_used"] = time.monotonic()
+        slot = entry["next"]
+        entry["next"] = (slot + 1) % SLOTS_PER_IMAGE
+        segment = entry["slots"][slot]
+        if segment is None or segment.size < nbytes:
+            if segment is not None:
+                self._destroy(segment)
+            segment = shared_memory.SharedMemory(name=f"bbridge_{uuid.uuid4().hex[:16]}", create=True, size=nbytes)
+            entry["slots"][slot] = segment
+        return segment
+
+    def publish(self, image_name, array):
+        """将数组写入该图像的下一个共享内存段，返回发送给 Blender 的描述信息。"""
+        array = np.ascontiguousarray(array)
+        with self.lock:
+            segment = self._segment_for(image_name, max(1, array.nbytes))
+            self._evict(keep=image_name)
+            target = np.ndarray(array.shape, dtype=array.dtype, buffer=segment.buf)
+            target[...] = array
+            del target # 释放对 segment.buf 的引用，以便之后可以关闭该段
+            return {
+                "shm_name": segment.name,
+                "shape": list(array.shape),
+                "dtype": array.dtype.name,
+                "frame": next(self.frame_counter),
+            }
+
+    def _evict(self, keep=None):
+        """释放超出数量上限或长时间空闲的目标图像的段（需持有锁）。keep 为刚写入的图像，不会被释放。"""
+        now = time.monotonic()
+        for image_name, entry in list(self.images.items()):
+            if image_name == keep:
+                continue
+            idle = SHM_IDLE_SECONDS > 0 and now - entry["last_used"] > SHM_IDLE_SECONDS
+            if not idle and len(self.images) <= SHM_MAX_IMAGES:
+                continue
+            self._release_entry(self.images.pop(image_name))
+
+    def _release_entry(self, entry):
+        for segment in entry.get("slots", []):
+            if segment is not None:
+                self._destroy(segment)
+
+    def release(self, image_name):
+        """释放某个目标图像的全部共享内存段。"""
+        with self.lock:
+            entry = self.images.pop(image_name, None)
+            if entry is not None:
+                self._release_entry(entry)
+
+    def release_all(self):
+        for image_name in list(self.images.keys()):
+            self.release(image_name)
+
+    @staticmethod
+    def _destroy(segment):
+        try:
+            segment.close()
+            segment.unlink()
+        except (FileNotFoundError, BufferError) as e:
+            print(f"[BlenderBridge-Sender] 释放共享内存段 {segment.name} 时出错: {e}")
+
+# 全局实例，进程退出时释放剩余的共享内存段，避免内存泄漏
+SHM_PUBLISHER = SharedFramePublisher()
+atexit.register(SHM_PUBLISHER.release_all)
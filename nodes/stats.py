@@ -0,0 +1,172 @@
+# nodes/stats.py
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+import numpy as np
+
+# --- 分阶段性能统计 ---
+# Receiver、DataHub 和 Sender 在每个阶段（接收、临时文件写入、EXR 读取、张量转换、编码、HTTP 发送等）
+# 记录耗时和字节数。每个 (会话, 阶段) 保留最近 STATS_WINDOW 个样本，用于计算滚动百分位数。
+# 统计信息通过 ZMQ 的 "stats" 请求查询，可输出为 JSON 或 Prometheus 文本格式。
+#
+# 逐帧追踪 (trace) 默认关闭：开启后每帧携带一个记录，依次追加经过的各阶段，
+# 在 Sender 发送完成后保存，最近 TRACE_HISTORY 帧可通过 "stats" 请求取回。
+
+STATS_WINDOW = int(os.environ.get("BLENDER_BRIDGE_STATS_WINDOW", "512"))
+TRACE_ENABLED = os.environ.get("BLENDER_BRIDGE_TRACE", "0").lower() in ("1", "true", "yes", "on")
+TRACE_HISTORY = 64
+PERCENTILES = (50, 90, 99)
+DEFAULT_SESSION = "default"
+
+class StageStats:
+    """一个 (会话, 阶段) 的滚动窗口。"""
+
+    def __init__(self, window=STATS_WINDOW):
+        self.samples = deque(maxlen=max(1, window))
+        self.count = 0
+        self.total_seconds = 0.0
+        self.total_bytes = 0
+
+    def add(self, seconds, nbytes=0):
+        self.samples.append(seconds)
+        self.count += 1
+        self.total_seconds += seconds
+        self.total_bytes += nbytes
+
+    def summary(self):
+        samples = np.fromiter(self.samples, dtype=np.float64, count=len(self.samples))
+        summary = {
+            "count": self.count,
+            "total_seconds": self.total_seconds,
+            "bytes": self.total_bytes,
+            "mean": float(samples.mean()) if samples.size else 0.0,
+            "max": float(samples.max()) if samples.size else 0.0,
+        }
+        values = np.percentile(samples, PERCENTILES) if samples.size else [0.0] * len(PERCENTILES)
+        summary.update({f"p{p}": float(v) for p, v in zip(PERCENTILES, values)})
+        return summary
+
+class PipelineStats:
+    def __init__(self, window=STATS_WINDOW, trace_enabled=TRACE_ENABLED):
+        self.lock = threading.Lock()
+        self.window = window
+        self.stages = {}
+        self.trace_enabled = trace_enabled
+        self.traces = deque(maxlen=TRACE_HISTORY)
+        self.local = threading.local()
+
+    def record(self, session_id, stage, seconds, nbytes=0, trace=None):
+        """记录一个阶段的耗时（秒）和处理的字节数。trace 为 None 时追加到当前线程的追踪记录（如果有）。"""
+        key = (str(session_id or DEFAULT_SESSION), stage)
+        with self.lock:
+            entry = self.stages.get(key)
+            if entry is None:
+                entry = self.stages[key] = StageStats(self.window)
+            entry.add(seconds, nbytes)
+        # trace=False 表示不追加到任何追踪记录
+        if trace is None:
+            trace = getattr(self.local, "trace", None)
+        if trace:
+            trace["stages"].append({"stage": stage, "seconds": seconds, "bytes": nbytes})
+
+    @contextmanager
+    def timed(self, session_id, stage, nbytes=0, trace=None):
+        """计时上下文管理器。发生异常时同样记录耗时。"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(session_id, stage, time.perf_counter() - start, nbytes, trace)
+
+    # --- 逐帧追踪 ---
+
+    def begin_trace(self, session_id, force=False):
+        """
+        开始一帧的追踪并绑定到当前线程，之后在该线程中记录的阶段都会追加到其中。
+        追踪未开启（且 force 不为真）时返回 None。
+        """
+        trace = None
+        if self.trace_enabled or force:
+            trace = {"session_id": str(session_id or DEFAULT_SESSION), "started": time.time(), "stages": []}
+        self.local.trace = trace
+        return trace
+
+    def current_trace(self):
+        return getattr(self.local, "trace", None)
+
+    def end_trace_scope(self):
+        """解除当前线程与追踪记录的绑定（记录本身随帧继续传递）。"""
+        self.local.trace = None
+
+    def finish_trace(self, trace):
+        """帧处理完毕（Sender 已发送），保存追踪记录。"""
+        if trace is None:
+            return
+        trace["total_seconds"] = time.time() - trace["started"]
+        with self.lock:
+            self.traces.append(trace)
+
+    def set_trace(self, enabled):
+        self.trace_enabled = bool(enabled)
+
+    def reset(self):
+        with self.lock:
+            self.stages.clear()
+            self.traces.clear()
+
+    # --- 导出 ---
+
+    def snapshot(self):
+        """返回 {会话: {阶段: 统计摘要}}。"""
+        with self.lock:
+            items = [(key, entry.summary()) for key, entry in self.stages.items()]
+        sessions = {}
+        for (session_id, stage), summary in sorted(items):
+            sessions.setdefault(session_id, {})[stage] = summary
+        return sessions
+
+    def recent_traces(self):
+        with self.lock:
+            return list(self.traces)
+
+    def to_prometheus(self, gauges=None):
+        """
+        以 Prometheus 文本格式导出各阶段的耗时 (summary) 和字节计数 (counter)。
+        gauges 为额外的 {分组: {名称: 数值}}，例如缓存和发送队列的统计信息。
+        """
+        lines = [
+            "# HELP blender_bridge_stage_seconds Per-stage latency in seconds.",
+            "# TYPE blender_bridge_stage_seconds summary",
+        ]
+        snapshot = self.snapshot()
+        for session_id, stages in snapshot.items():
+            for stage, summary in stages.items():
+                labels = f'session="{_escape_label(session_id)}",stage="{stage}"'
+                for p in PERCENTILES:
+                    lines.append(f'blender_bridge_stage_seconds{{{labels},quantile="{p / 100}"}} {summary[f"p{p}"]:.6f}')
+                lines.append(f"blender_bridge_stage_seconds_sum{{{labels}}} {summary['total_seconds']:.6f}")
+                lines.append(f"blender_bridge_stage_seconds_count{{{labels}}} {summary['count']}")
+        lines += [
+            "# HELP blender_bridge_stage_bytes_total Bytes processed per stage.",
+            "# TYPE blender_bridge_stage_bytes_total counter",
+        ]
+        for session_id, stages in snapshot.items():
+            for stage, summary in stages.items():
+                lines.append(f'blender_bridge_stage_bytes_total{{session="{_escape_label(session_id)}",stage="{stage}"}} {summary["bytes"]}')
+        for group, values in (gauges or {}).items():
+            for name, value in values.items():
+                if isinstance(value, bool) or not isinstance(value, (int, float)):
+                    continue
+                metric = f"blender_bridge_{group}_{name}"
+                lines.append(f"# TYPE {metric} gauge")
+                lines.append(f"{metric} {value}")
+        return "\n".join(lines) + "\n"
+
+def _escape_label(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+# 全局实例，由所有节点和服务器线程共享
+STATS = PipelineStats()
@@ -0,0 +1,172 @@
+# nodes/uploader.py
+import http.client
+import itertools
+import os
+import threading
+import time
+from collections import OrderedDict
+from urllib.parse import urlsplit
+
+# --- 发送回 Blender 的 HTTP 传输层 ---
+# 1. ConnectionPool: 为每个 blender_server_address 保持一个持久 (keep-alive) 连接，
+#    避免每张图像都重新建立 TCP 连接。
+# 2. BackgroundUploader: 有界的后台发送队列。节点只需将任务入队即可返回，
+#    同一目标图像的旧任务会被新任务替换（最新优先），过期的帧不会被发送。
+
+# 每个 Blender 地址最多排队的待发送任务数
+DEFAULT_MAX_PENDING = int(os.environ.get("BLENDER_BRIDGE_SEND_QUEUE", "4"))
+# 发送失败时的重试次数和初始退避时间（秒），每次重试退避时间加倍
+DEFAULT_RETRIES = int(os.environ.get("BLENDER_BRIDGE_SEND_RETRIES", "3"))
+DEFAULT_BACKOFF = float(os.environ.get("BLENDER_BRIDGE_SEND_BACKOFF", "0.25"))
+DEFAULT_TIMEOUT = float(os.environ.get("BLENDER_BRIDGE_SEND_TIMEOUT", "30"))
+
+class HTTPSendError(Exception):
+    """Blender 返回了非 2xx 状态码。status >= 500 的错误会被重试。"""
+
+    def __init__(self, status, reason, body=""):
+        super().__init__(f"{status} {reason}" + (f"\n详情: {body}" if body else ""))
+        self.status = status
+        self.reason = reason
+        self.body = body
+
+class ConnectionPool:
+    """每个服务器地址一个持久 HTTP 连接。同一地址的请求串行使用该连接。"""
+
+    def __init__(self, timeout=DEFAULT_TIMEOUT):
+        self.timeout = timeout
+        self.lock = threading.Lock()
+        self.connections = {}
+
+    def _get(self, server_address):
+        with self.lock:
+            entry = self.connections.get(server_address)
+            if entry is None:
+                parts = urlsplit(server_address)
+                conn_cls = http.client.HTTPSConnection if parts.scheme == "https" else http.client.HTTPConnection
+                conn = conn_cls(parts.hostname or "127.0.0.1", parts.port, timeout=self.timeout)
+                entry = self.connections[server_address] = {"conn": conn, "lock": threading.Lock(), "base": parts.path.rstrip("/")}
+            return entry
+
+    def post(self, server_address, path, body, headers):
+        """
+        通过持久连接发送 POST 请求，返回 (status, reason, body)。
+        如果服务器已关闭了空闲连接，会立即重新连接并重发一次。
+        """
+        entry = self._get(server_address)
+        with entry["lock"]:
+            conn = entry["conn"]
+            for attempt in range(2):
+                try:
+                    conn.request("POST", entry["base"] + path, body=body, headers=headers)
+                    response = conn.getresponse()
+                    # 必须读完响应体，连接才能被复用
+                    data = response.read()
+                    if response.will_close:
+                        conn.close()
+                    return response.status, response.reason, data
+                except (http.client.RemoteDisconnected, BrokenPipeError, ConnectionResetError, http.client.CannotSendRequest):
+                    conn.close()
+                    if attempt == 1:
+                        raise
+                except Exception:
+                    conn.close()
+                    raise
+
+    def close_all(self):
+        with self.lock:
+            for entry in self.connections.values():
+                entry["conn"].close()
+            self.connections.clear()
+
+def post_with_retry(pool, server_address, path, body, headers, retries=DEFAULT_RETRIES, backoff=DEFAULT_BACKOFF):
+    """发送请求，在网络错误或 5xx 响应时按指数退避重试。返回响应体。"""
+    delay = backoff
+    for attempt in range(retries + 1):
+        try:
+            status, reason, data = pool.post(server_address, path, body, headers)
+        except (OSError, http.client.HTTPException) as e:
+            error = e
+        else:
+            if 200 <= status < 300:
+                return data
+            error = HTTPSendError(status, reason, data.decode("utf-8", errors="ignore"))
+            if status < 500:
+                raise error
+        if attempt < retries:
+            print(f"[BlenderBridge-Sender] 发送失败 ({error})，{delay:.2f} 秒后重试 ({attempt + 1}/{retries})...")
+            time.sleep(delay)
+            delay *= 2
+    raise error
+
+class BackgroundUploader:
+    """
+    有界的后台发送队列，每个 Blender 地址一个工作线程。
+    任务以 key（通常是目标图像数据块名称）标识：同一 key 的待发送任务会被新任务替换。
+    队列已满时丢弃最旧的任务。coalesce=False 的任务（例如动画批次）既不会被替换，也不会被丢弃。
+    """
+
+    def __init__(self, max_pending=DEFAULT_MAX_PENDING):
+        self.max_pending = max(1, max_pending)
+        self.lock = threading.Lock()
+        self.queues = {}
+        self.sent = 0
+        self.failed = 0
+        self.dropped = 0
+        # 为每个不可合并的任务生成唯一的键，相同 key 的多次提交互不覆盖
+        self.submissions = itertools.count(1)
+
+    def submit(self, server_address, key, job, coalesce=True):
+        """将任务 (无参数的可调用对象) 入队并立即返回。"""
+        with self.lock:
+            if not coalesce:
+                key = (key, next(self.submissions))
+            queue = self.queues.get(server_address)
+            if queue is None:
+                queue = self.queues[server_address] = {"pending": OrderedDict(), "event": threading.Event()}
+                worker = threading.Thread(target=self._worker, args=(server_address, queue), daemon=True)
+                worker.start()
+            pending = queue["pending"]
+            if key in pending and pending[key][1]:
+                # 最新优先: 丢弃同一目标尚未发送的旧帧
+                del pending[key]
+                self.dropped += 1
+            pending[key] = (job, coalesce)
+            while len(pending) > self.max_pending:
+                # 只丢弃可合并的任务，且不丢弃刚提交的任务（它已替换了同一目标的旧帧）；
+                # 其余都是不可丢弃的任务时允许暂时超出容量
+                oldest = next((k for k, (_, c) in pending.items() if c and k != key), None)
+                if oldest is None:
+                    break
+                del pending[oldest]
+                self.dropped += 1
+            queue["event"].set()
+
+    def _worker(self, server_address, queue):
+        while True:
+            queue["event"].wait()
+            with self.lock:
+                if not queue["pending"]:
+                    queue["event"].clear()
+                    continue
+                key, (job, _) = queue["pending"].popitem(last=False)
+            try:
+                job()
+                with self.lock:
+                    self.sent += 1
+            except Exception as e:
+                with self.lock:
+                    self.failed += 1
+                print(f"[BlenderBridge-Sender] 后台发送 '{key}' 到 {server_address} 失败: {e}")
+
+    def stats(self):
+        with self.lock:
+            return {
+                "pending": sum(len(q["pending"]) for q in self.queues.values()),
+                "sent": self.sent,
+                "failed": self.failed,
+                "dropped": self.dropped,
+            }
+
+# 全局实例，由所有 Sender 节点共享
+HTTP_POOL = ConnectionPool()
+UPLOADER = BackgroundUploader()